@@ -1,114 +1,1684 @@
 import os
 import re
+import io
 import json
+import time
+import heapq
+import hashlib
+import random
+import pstats
+import sqlite3
+import cProfile
 import logging
+import threading
+from array import array
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import google.generativeai as genai
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, has_request_context, request, jsonify, send_from_directory, stream_with_context
 import jwt
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import cached_property
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global storage for hackathon (single user)
-user_goal = {}
-user_budgets = {}
+# Epoch used for compact day numbers; MISSING_DAY marks unparseable dates
+EPOCH_DATE = date(1970, 1, 1)
+MISSING_DAY = -(2 ** 31)
+
+# Bank transaction sync settings; BANK_API_URL may contain {account} (JWT 'acct' claim) and {user}
+BANK_API_URL = os.getenv("BANK_API_URL")
+BANK_PAGE_SIZE = int(os.getenv("BANK_PAGE_SIZE", "500"))
+BANK_TIMEOUT_SECONDS = float(os.getenv("BANK_TIMEOUT_SECONDS", "10"))
+BANK_SYNC_INTERVAL_SECONDS = float(os.getenv("BANK_SYNC_INTERVAL_SECONDS", "60"))
+BANK_POOL_SIZE = int(os.getenv("BANK_POOL_SIZE", "32"))
+LEDGER_DB_PATH = os.getenv("LEDGER_DB_PATH", "transactions.db")
+
+# Instrumentation settings
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+# Per-user state settings
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "user_state.db")
+STATE_CACHE_TTL_SECONDS = float(os.getenv("STATE_CACHE_TTL_SECONDS", "5"))
+JWT_PUBLIC_KEY = os.getenv("JWT_PUBLIC_KEY")
+JWT_ALGORITHMS = os.getenv("JWT_ALGORITHMS", "RS256").split(",")
+# Development only: trust unsigned token claims when no JWT_PUBLIC_KEY is set
+JWT_ALLOW_UNVERIFIED = os.getenv("JWT_ALLOW_UNVERIFIED", "").lower() in ("1", "true", "yes")
+
+# Model client settings
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini")
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "models/gemini-1.5-flash-latest")
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "16"))
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "30"))
+
+# Q&A prompt size settings
+QA_PROMPT_TOKEN_BUDGET = int(os.getenv("QA_PROMPT_TOKEN_BUDGET", "2000"))
+TOP_MERCHANT_COUNT = int(os.getenv("TOP_MERCHANT_COUNT", "10"))
+SUMMARY_MONTH_COUNT = int(os.getenv("SUMMARY_MONTH_COUNT", "12"))
+CHARS_PER_TOKEN = 4
+
+# Proactive tip settings
+TIP_WINDOW_DAYS = int(os.getenv("TIP_WINDOW_DAYS", "30"))
+TIP_REFRESH_SECONDS = float(os.getenv("TIP_REFRESH_SECONDS", "3600"))
+SUBSCRIPTION_MIN_CHARGES = int(os.getenv("SUBSCRIPTION_MIN_CHARGES", "3"))
+SUBSCRIPTION_SPIKE_RATIO = float(os.getenv("SUBSCRIPTION_SPIKE_RATIO", "1.25"))
+SUBSCRIPTION_AMOUNT_TOLERANCE = float(os.getenv("SUBSCRIPTION_AMOUNT_TOLERANCE", "0.1"))
+SUBSCRIPTION_MIN_INTERVAL_DAYS = int(os.getenv("SUBSCRIPTION_MIN_INTERVAL_DAYS", "7"))
+SUBSCRIPTION_INTERVAL_TOLERANCE = float(os.getenv("SUBSCRIPTION_INTERVAL_TOLERANCE", "0.25"))
+SUBSCRIPTION_EXCLUDED_CATEGORIES = ("Transfers", "Salary/Income")
+
+# Categories the co-pilot assigns to transactions
+CATEGORIES = ["Salary/Income", "Groceries", "Utilities", "Rent/Mortgage", "Transport", "Shopping", "Entertainment", "Health", "Dining", "Transfers", "Other"]
+
+# Built-in merchant rules: normalized description phrase -> category
+DEFAULT_MERCHANT_RULES = {
+    "salary": "Salary/Income", "payroll": "Salary/Income", "direct deposit": "Salary/Income",
+    "grocery": "Groceries", "supermarket": "Groceries", "whole foods": "Groceries", "trader joe s": "Groceries",
+    "walmart": "Groceries", "kroger": "Groceries", "aldi": "Groceries", "lidl": "Groceries", "costco": "Groceries",
+    "electric": "Utilities", "water bill": "Utilities", "internet": "Utilities", "comcast": "Utilities",
+    "verizon": "Utilities", "at t": "Utilities", "phone bill": "Utilities", "utility": "Utilities",
+    "rent": "Rent/Mortgage", "mortgage": "Rent/Mortgage", "landlord": "Rent/Mortgage",
+    "uber": "Transport", "lyft": "Transport", "gas station": "Transport", "shell": "Transport",
+    "chevron": "Transport", "parking": "Transport", "metro": "Transport", "transit": "Transport", "taxi": "Transport",
+    "amazon": "Shopping", "zara": "Shopping", "h m": "Shopping", "ikea": "Shopping", "target": "Shopping",
+    "ebay": "Shopping", "shopping": "Shopping",
+    "netflix": "Entertainment", "spotify": "Entertainment", "hulu": "Entertainment", "disney": "Entertainment",
+    "cinema": "Entertainment", "concert": "Entertainment", "steam": "Entertainment", "tickets": "Entertainment",
+    "pharmacy": "Health", "cvs": "Health", "walgreens": "Health", "doctor": "Health", "dental": "Health",
+    "hospital": "Health", "gym": "Health",
+    "starbucks": "Dining", "coffee": "Dining", "restaurant": "Dining", "mcdonald s": "Dining", "cafe": "Dining",
+    "pizza": "Dining", "doordash": "Dining", "uber eats": "Dining", "grubhub": "Dining", "chipotle": "Dining",
+    "transfer": "Transfers", "zelle": "Transfers", "venmo": "Transfers", "paypal": "Transfers"
+}
+
+# Categorization batching settings
+CATEGORIZE_CHUNK_SIZE = int(os.getenv("CATEGORIZE_CHUNK_SIZE", "75"))
+CATEGORIZE_MAX_WORKERS = int(os.getenv("CATEGORIZE_MAX_WORKERS", "8"))
+CATEGORIZE_RETRIES = int(os.getenv("CATEGORIZE_RETRIES", "2"))
+
+# Q&A answer cache settings
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "300"))
+
+# Category cache settings
+CATEGORY_CACHE_PATH = os.getenv("CATEGORY_CACHE_PATH", "category_cache.db")
+CATEGORY_CACHE_MAX_ENTRIES = int(os.getenv("CATEGORY_CACHE_MAX_ENTRIES", "50000"))
+
+# Bounded pool shared by all categorization requests
+categorize_executor = ThreadPoolExecutor(max_workers=CATEGORIZE_MAX_WORKERS, thread_name_prefix="categorize")
 
 # Create Flask application
 app = Flask(__name__, static_folder='static')
 
-def configure_gemini():
-    """Initialize Gemini model with API key from environment."""
+# Histogram buckets for durations (seconds) and prompt/response sizes (characters)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+ROW_BUCKETS = (0, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Metric name -> (type, help, label names, histogram buckets)
+METRIC_DEFINITIONS = {
+    "copilot_http_request_seconds": ("histogram", "HTTP request latency by endpoint and status.", ("endpoint", "status"), LATENCY_BUCKETS),
+    "copilot_stage_seconds": ("histogram", "Time spent in each request pipeline stage.", ("stage",), LATENCY_BUCKETS),
+    "copilot_chat_intent_total": ("counter", "Chat requests by detected intent.", ("intent",), None),
+    "copilot_llm_call_seconds": ("histogram", "Model call latency by purpose.", ("purpose",), LATENCY_BUCKETS),
+    "copilot_llm_first_token_seconds": ("histogram", "Time to first streamed chunk.", ("purpose",), LATENCY_BUCKETS),
+    "copilot_llm_prompt_chars": ("histogram", "Prompt size in characters by purpose.", ("purpose",), SIZE_BUCKETS),
+    "copilot_llm_response_chars": ("histogram", "Response size in characters by purpose.", ("purpose",), SIZE_BUCKETS),
+    "copilot_qa_context_chars": ("histogram", "Q&A prompt context size in characters.", (), SIZE_BUCKETS),
+    "copilot_qa_context_tokens": ("histogram", "Estimated Q&A prompt context size in tokens.", (), SIZE_BUCKETS),
+    "copilot_qa_context_rows": ("histogram", "Transaction rows included in the Q&A prompt context.", (), ROW_BUCKETS),
+    "copilot_llm_errors_total": ("counter", "Failed model calls by purpose.", ("purpose",), None),
+    "copilot_categorization_retries_total": ("counter", "Categorization chunk calls that were retried.", (), None),
+    "copilot_categorization_fallback_total": ("counter", "Transactions that fell back to 'Uncategorized' or 'Other'.", ("fallback",), None),
+    "copilot_categorized_transactions_total": ("counter", "Categorized transactions by source (cache, rules, model).", ("source",), None),
+    "copilot_slot_parse_total": ("counter", "Goal/budget extraction by source (local, model, failed).", ("intent", "source"), None),
+    "copilot_bank_sync_total": ("counter", "Bank syncs by outcome (fresh, updated, unchanged, unsaved, error).", ("outcome",), None),
+    "copilot_category_cache_hits_total": ("counter", "Category cache hits.", (), None),
+    "copilot_category_cache_misses_total": ("counter", "Category cache misses.", (), None),
+    "copilot_answer_cache_hits_total": ("counter", "Q&A answer cache hits.", (), None),
+    "copilot_answer_cache_misses_total": ("counter", "Q&A answer cache misses.", (), None),
+    "copilot_coalesced_calls_total": ("counter", "Calls that shared the result of an identical in-flight call.", ("flight",), None)
+}
+
+class Metrics:
+    """
+    Prometheus counters and histograms, looked up by name.
+    Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) makes
+    every worker write its values there, and render() sums them across all
+    workers, including ones that have exited.
+    """
+
+    def __init__(self, definitions):
+        self._metrics = {}
+        for name, (metric_type, help_text, label_names, buckets) in definitions.items():
+            if metric_type == "histogram":
+                self._metrics[name] = Histogram(name, help_text, label_names, buckets=buckets)
+            else:
+                self._metrics[name] = Counter(name, help_text, label_names)
+
+    def _child(self, name, labels):
+        metric = self._metrics[name]
+        return metric.labels(**labels) if labels else metric
+
+    def inc(self, name, amount=1, **labels):
+        self._child(name, labels).inc(amount)
+
+    def observe(self, name, value, **labels):
+        self._child(name, labels).observe(value)
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry)
+        return generate_latest(REGISTRY)
+
+metrics = Metrics(METRIC_DEFINITIONS)
+
+@contextmanager
+def stage_timer(stage):
+    """Time a pipeline stage into copilot_stage_seconds and the request's Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("copilot_stage_seconds", elapsed, stage=stage)
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((stage, elapsed))
+
+@app.before_request
+def _start_request_instrumentation():
+    g.request_start = time.perf_counter()
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def _finish_request_instrumentation(response):
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe("copilot_http_request_seconds", elapsed, endpoint=endpoint, status=response.status_code)
+    
+    if TIMING_HEADERS or request.headers.get('X-Debug-Timing'):
+        timings = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in g.get('stage_timings', [])]
+        timings.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers['Server-Timing'] = ", ".join(timings)
+    
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        _save_profile(profiler, endpoint, elapsed)
+    return response
+
+def _save_profile(profiler, endpoint, elapsed):
+    """Dump a sampled request profile to PROFILE_DIR, or log its top functions."""
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{endpoint}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        logger.info("Saved %.1fms profile of %s to %s", elapsed * 1000, endpoint, path)
+    else:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(15)
+        logger.info("Profile of %s (%.1fms):\n%s", endpoint, elapsed * 1000, output.getvalue())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype=CONTENT_TYPE_LATEST)
+
+class GeminiBackend:
+    """Model backend that calls the Google Gemini API."""
+
+    def __init__(self, api_key, model_name):
+        genai.configure(api_key=api_key)
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, prompt, timeout=None, **kwargs):
+        if timeout:
+            kwargs['request_options'] = {'timeout': timeout}
+        return self._model.generate_content(prompt, **kwargs)
+
+class StubResponse:
+    """Minimal stand-in for a Gemini response."""
+
+    def __init__(self, text):
+        self.text = text
+
+def _default_stub_reply(prompt):
+    """Answer the co-pilot's prompts with well-formed placeholder output."""
+    if "Analyze the following bank transactions" in prompt:
+        payload = prompt.split("Transactions:", 1)[1]
+        try:
+            items = json.loads(payload[payload.index('['):payload.rindex(']') + 1])
+        except ValueError:
+            items = []
+        return json.dumps([{"id": item.get("id"), "category": "Other"} for item in items])
+    if "Return ONLY a JSON object" in prompt:
+        return "{}"
+    return "This is a simulated answer from the stub model."
+
+class StubBackend:
+    """Local model backend with configurable simulated latency, for tests and benchmarks."""
+
+    def __init__(self, latency=0.0, jitter=0.0, responder=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.responder = responder or _default_stub_reply
+
+    def generate_content(self, prompt, timeout=None, stream=False, **kwargs):
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        text = self.responder(prompt)
+        if stream:
+            return self._stream(text, delay)
+        if delay > 0:
+            time.sleep(delay)
+        return StubResponse(text)
+
+    def _stream(self, text, delay):
+        words = re.findall(r'\S+\s*', text) or [text]
+        for word in words:
+            if delay > 0:
+                time.sleep(delay / len(words))
+            yield StubResponse(word)
+
+def _create_gemini_backend():
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         logger.error("GEMINI_API_KEY not found in environment variables")
         return None
+    return GeminiBackend(api_key, GEMINI_MODEL_NAME)
+
+def _create_stub_backend():
+    return StubBackend(
+        latency=float(os.getenv("MODEL_STUB_LATENCY_MS", "0")) / 1000.0,
+        jitter=float(os.getenv("MODEL_STUB_JITTER_MS", "0")) / 1000.0
+    )
+
+MODEL_BACKENDS = {
+    "gemini": _create_gemini_backend,
+    "stub": _create_stub_backend
+}
+
+class ModelClient:
+    """
+    Process-wide entry point for model calls.
+    Bounds the number of in-flight calls and applies a per-call timeout.
+    """
+
+    def __init__(self, backend, max_concurrency, timeout):
+        self.backend = backend
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def generate_content(self, prompt, purpose='other', **kwargs):
+        if not self._semaphore.acquire(timeout=self.timeout):
+            metrics.inc("copilot_llm_errors_total", purpose=purpose)
+            raise TimeoutError("Timed out waiting for a free model slot")
+        metrics.observe("copilot_llm_prompt_chars", len(prompt), purpose=purpose)
+        start = time.perf_counter()
+        try:
+            response = self.backend.generate_content(prompt, timeout=self.timeout, **kwargs)
+        except Exception:
+            metrics.inc("copilot_llm_errors_total", purpose=purpose)
+            raise
+        finally:
+            self._semaphore.release()
+            metrics.observe("copilot_llm_call_seconds", time.perf_counter() - start, purpose=purpose)
+        try:
+            metrics.observe("copilot_llm_response_chars", len(response.text), purpose=purpose)
+        except Exception:
+            pass
+        return response
+
+    def stream_content(self, prompt, purpose='other', **kwargs):
+        """Yield the response text chunk by chunk, holding a model slot until done."""
+        if not self._semaphore.acquire(timeout=self.timeout):
+            metrics.inc("copilot_llm_errors_total", purpose=purpose)
+            raise TimeoutError("Timed out waiting for a free model slot")
+        metrics.observe("copilot_llm_prompt_chars", len(prompt), purpose=purpose)
+        start = time.perf_counter()
+        response_chars = 0
+        try:
+            for chunk in self.backend.generate_content(prompt, timeout=self.timeout, stream=True, **kwargs):
+                text = chunk.text
+                if text:
+                    if not response_chars:
+                        metrics.observe("copilot_llm_first_token_seconds", time.perf_counter() - start, purpose=purpose)
+                    response_chars += len(text)
+                    yield text
+        except Exception:
+            metrics.inc("copilot_llm_errors_total", purpose=purpose)
+            raise
+        finally:
+            self._semaphore.release()
+            metrics.observe("copilot_llm_call_seconds", time.perf_counter() - start, purpose=purpose)
+            metrics.observe("copilot_llm_response_chars", response_chars, purpose=purpose)
+
+_model_client = None
+_model_client_lock = threading.Lock()
+
+def _sse_event(data, event=None):
+    """Format one Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def get_model():
+    """Return the shared model client, initializing it on first use."""
+    global _model_client
+    if _model_client is not None:
+        return _model_client
     
+    with _model_client_lock:
+        if _model_client is None:
+            factory = MODEL_BACKENDS.get(MODEL_BACKEND)
+            if not factory:
+                logger.error("Unknown MODEL_BACKEND '%s'", MODEL_BACKEND)
+                return None
+            try:
+                backend = factory()
+            except Exception as e:
+                logger.exception("Failed to configure model backend")
+                return None
+            if backend is None:
+                return None
+            _model_client = ModelClient(backend, MODEL_MAX_CONCURRENCY, MODEL_TIMEOUT_SECONDS)
+        return _model_client
+
+def set_model_backend(backend):
+    """Replace the shared model client's backend, e.g. with a StubBackend."""
+    global _model_client
+    with _model_client_lock:
+        _model_client = ModelClient(backend, MODEL_MAX_CONCURRENCY, MODEL_TIMEOUT_SECONDS) if backend else None
+
+# FOR HACKATHON DEMO: served when no BANK_API_URL is configured
+SAMPLE_TRANSACTIONS = [
+    {"transactionId": 1, "description": "Starbucks Coffee", "amount": -545, "date": "2025-09-21T10:00:00Z"},
+    {"transactionId": 2, "description": "Salary Deposit - Acme Corp", "amount": 250000, "date": "2025-09-20T09:00:00Z"},
+    {"transactionId": 3, "description": "Grocery Store Bill", "amount": -7520, "date": "2025-09-20T18:30:00Z"},
+    {"transactionId": 4, "description": "Netflix Subscription", "amount": -1599, "date": "2025-09-19T12:00:00Z"},
+    {"transactionId": 5, "description": "Transfer to Bob", "amount": -10000, "date": "2025-09-18T15:00:00Z"},
+    {"transactionId": 6, "description": "Zara Shopping", "amount": -12450, "date": "2025-09-17T11:45:00Z"},
+    {"transactionId": 7, "description": "Gas Station", "amount": -4500, "date": "2025-09-16T08:20:00Z"},
+    {"transactionId": 8, "description": "Concert Tickets", "amount": -8500, "date": "2025-09-15T20:00:00Z"}
+]
+
+def _parse_date(date_str):
+    """Parse the date part of an ISO timestamp, or return None."""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('models/gemini-1.5-flash-latest')
-        return model
-    except Exception as e:
-        logger.exception("Failed to configure Gemini model")
+        return datetime.fromisoformat(str(date_str).split('T')[0]).date() if date_str else None
+    except (ValueError, TypeError):
         return None
 
-def get_transactions(auth_header):
-    """FOR HACKATHON DEMO: Returns a hardcoded list of sample transactions."""
-    fake_transactions = [
-        {"transactionId": 1, "description": "Starbucks Coffee", "amount": -545, "date": "2025-09-21T10:00:00Z"},
-        {"transactionId": 2, "description": "Salary Deposit - Acme Corp", "amount": 250000, "date": "2025-09-20T09:00:00Z"},
-        {"transactionId": 3, "description": "Grocery Store Bill", "amount": -7520, "date": "2025-09-20T18:30:00Z"},
-        {"transactionId": 4, "description": "Netflix Subscription", "amount": -1599, "date": "2025-09-19T12:00:00Z"},
-        {"transactionId": 5, "description": "Transfer to Bob", "amount": -10000, "date": "2025-09-18T15:00:00Z"},
-        {"transactionId": 6, "description": "Zara Shopping", "amount": -12450, "date": "2025-09-17T11:45:00Z"},
-        {"transactionId": 7, "description": "Gas Station", "amount": -4500, "date": "2025-09-16T08:20:00Z"},
-        {"transactionId": 8, "description": "Concert Tickets", "amount": -8500, "date": "2025-09-15T20:00:00Z"}
-    ]
-    return fake_transactions
-
-def categorize_transactions(transactions_data, model):
+def _epoch_day(day):
+    """Days since 1970-01-01 for a date."""
+    return (day - EPOCH_DATE).days
+
+class ExpenseWindow:
     """
-    Categorize transactions using Gemini AI.
-    Takes latest 75 transactions and adds 'category' field to each.
+    Largest expenses of the last window_days days.
+    A max-heap by amount; entries that slide out of the window are dropped
+    lazily as they surface, and the heap is compacted when it doubles.
     """
-    if not isinstance(transactions_data, list) or not transactions_data or not model:
-        return transactions_data
-    
-    # Limit to latest 75 transactions for performance
-    transactions_to_process = transactions_data[:75]
-    
+
+    def __init__(self, window_days):
+        self.window_days = window_days
+        self._heap = []
+        self._compact_at = 1024
+        self._lock = threading.Lock()
+
+    def _start_day(self):
+        return _epoch_day(date.today()) - self.window_days
+
+    def add(self, amount, day, row):
+        """Track an expense (negative amount in cents) if it falls inside the window."""
+        if amount >= 0 or day < self._start_day():
+            return
+        with self._lock:
+            heapq.heappush(self._heap, (amount, day, row))
+            if len(self._heap) >= self._compact_at:
+                start_day = self._start_day()
+                self._heap = [entry for entry in self._heap if entry[1] >= start_day]
+                heapq.heapify(self._heap)
+                self._compact_at = max(1024, 2 * len(self._heap))
+
+    def top(self, count):
+        """Return up to count (amount, day, row) entries, largest expense first."""
+        start_day = self._start_day()
+        result = []
+        with self._lock:
+            while self._heap and len(result) < count:
+                entry = heapq.heappop(self._heap)
+                if entry[1] >= start_day:
+                    result.append(entry)
+            for entry in result:
+                heapq.heappush(self._heap, entry)
+        return result
+
+class TransactionStore:
+    """
+    Columnar store of transactions.
+    Amounts (cents), epoch days and category codes live in compact arrays,
+    dates are parsed once at ingest, and rows are indexed by (year, month)
+    and category so aggregations become masked NumPy sums.
+    Spending per (month, category) and income since a tracked start day are
+    kept as running totals, updated as rows are ingested or re-categorized.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.recent_expenses = ExpenseWindow(TIP_WINDOW_DAYS)
+        self.ids = []
+        self.descriptions = []
+        self._amounts = array('q')
+        self._days = array('l')
+        self._categories = array('h')
+        self._row_by_id = {}
+        self._month_index = {}
+        self._category_codes = {}
+        self._category_names = []
+        self._lock = threading.RLock()
+        self._columns = None
+        self._category_index = None
+        self.version = 0
+        self._spent = {}
+        self._income_total = 0
+        self._income_start_day = None
+        self._income_since_start = 0
+        self._income_by_month = {}
+        self._merchant_rows = {}
+        self._merchant_spent = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _row_key(transaction):
+        """Identify a transaction by its transactionId, or by its contents when it has none."""
+        transaction_id = transaction.get('transactionId')
+        if transaction_id is not None:
+            return transaction_id
+        return (transaction.get('date'), transaction.get('description'), transaction.get('amount'))
+
+    def category_code(self, category):
+        """Return the integer code of a category, assigning one if new."""
+        if category is None:
+            return -1
+        code = self._category_codes.get(category)
+        if code is None:
+            code = len(self._category_names)
+            self._category_codes[category] = code
+            self._category_names.append(category)
+        return code
+
+    def ingest(self, transactions):
+        """Append transactions not seen before; returns the number of new rows."""
+        added = 0
+        with self._lock:
+            for t in transactions:
+                key = self._row_key(t)
+                if key in self._row_by_id:
+                    continue
+                row = len(self.ids)
+                day = _parse_date(t.get('date'))
+                try:
+                    amount = int(round(float(t.get('amount', 0) or 0)))
+                except (ValueError, TypeError):
+                    amount = 0
+                self.ids.append(t.get('transactionId'))
+                self.descriptions.append(t.get('description', ''))
+                self._amounts.append(amount)
+                self._days.append(_epoch_day(day) if day else MISSING_DAY)
+                self._categories.append(self.category_code(t.get('category')))
+                self._row_by_id[key] = row
+                if day:
+                    self._month_index.setdefault((day.year, day.month), []).append(row)
+                    if amount > 0:
+                        month = (day.year, day.month)
+                        self._income_by_month[month] = self._income_by_month.get(month, 0) + amount
+                merchant = _merchant_key(t.get('description'))
+                self._merchant_rows.setdefault(merchant, []).append(row)
+                if amount < 0:
+                    self._merchant_spent[merchant] = self._merchant_spent.get(merchant, 0) - amount
+                self._add_to_aggregates(row, 1)
+                if day:
+                    self.recent_expenses.add(amount, _epoch_day(day), row)
+                added += 1
+            if added:
+                self._columns = None
+                self._category_index = None
+                self.version += 1
+        if added and self.on_change:
+            self.on_change()
+        return added
+
+    def set_categories(self, transactions):
+        """Record the 'category' assigned to already ingested transactions."""
+        changed = False
+        with self._lock:
+            for t in transactions:
+                row = self._row_by_id.get(self._row_key(t))
+                if row is None or not t.get('category'):
+                    continue
+                code = self.category_code(t['category'])
+                if self._categories[row] != code:
+                    self._add_to_aggregates(row, -1)
+                    self._categories[row] = code
+                    self._add_to_aggregates(row, 1)
+                    changed = True
+            if changed:
+                self._columns = None
+                self._category_index = None
+                self.version += 1
+        if changed and self.on_change:
+            self.on_change()
+
+    def snapshot_id(self):
+        """Identify the current contents; changes whenever rows are added or re-categorized."""
+        return f"{len(self.ids)}-{self.version}"
+
+    def _add_to_aggregates(self, row, sign):
+        """Add (sign=1) or remove (sign=-1) one row from the running totals."""
+        amount = self._amounts[row]
+        day = self._days[row]
+        if amount > 0:
+            self._income_total += sign * amount
+            if self._income_start_day is not None and day >= self._income_start_day:
+                self._income_since_start += sign * amount
+        elif amount < 0 and day != MISSING_DAY:
+            month_date = EPOCH_DATE + timedelta(days=day)
+            key = (month_date.year, month_date.month, self._categories[row])
+            self._spent[key] = self._spent.get(key, 0) - sign * amount
+
+    def columns(self):
+        """Return (amount_cents, epoch_day, category_code) as NumPy arrays."""
+        with self._lock:
+            if self._columns is None:
+                self._columns = (
+                    np.array(self._amounts, dtype=np.int64),
+                    np.array(self._days, dtype=np.int64),
+                    np.array(self._categories, dtype=np.int16)
+                )
+            return self._columns
+
+    def months(self):
+        """Return the (year, month) pairs that have transactions."""
+        return list(self._month_index)
+
+    def rows_for_month(self, year, month):
+        """Row indices of transactions dated in the given month."""
+        return np.array(self._month_index.get((year, month), ()), dtype=np.int64)
+
+    def rows_for_category(self, category):
+        """Row indices of transactions with the given category."""
+        with self._lock:
+            if self._category_index is None:
+                codes = self.columns()[2]
+                order = np.argsort(codes, kind='stable')
+                boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+                self._category_index = {
+                    int(codes[group[0]]): group for group in np.split(order, boundaries) if len(group)
+                }
+            code = self._category_codes.get(category)
+            return self._category_index.get(code, np.array((), dtype=np.int64))
+
+    def category_spent(self, year, month, category):
+        """Total expenses in cents for a category in a month."""
+        code = self._category_codes.get(category)
+        if code is None:
+            return 0
+        return self._spent.get((year, month, code), 0)
+
+    def income_since(self, start_day=None):
+        """
+        Total deposits in cents, optionally only from an epoch day onwards.
+        The first call for a new start day sums the columns once; after that
+        the total is kept up to date by ingest.
+        """
+        if start_day is None:
+            return self._income_total
+        with self._lock:
+            if start_day != self._income_start_day:
+                amounts, days, _ = self.columns()
+                self._income_start_day = start_day
+                self._income_since_start = int(amounts[(amounts > 0) & (days >= start_day)].sum())
+            return self._income_since_start
+
+    def monthly_spending(self):
+        """Return {'YYYY-MM': {category: cents}} of all expenses."""
+        result = {}
+        with self._lock:
+            for (year, month, code), cents in self._spent.items():
+                if cents:
+                    category = self._category_names[code] if code >= 0 else 'Uncategorized'
+                    result.setdefault(f"{year:04d}-{month:02d}", {})[category] = cents
+        return result
+
+    def category_totals(self):
+        """Return {category: cents} of all expenses."""
+        totals = {}
+        for categories in self.monthly_spending().values():
+            for category, cents in categories.items():
+                totals[category] = totals.get(category, 0) + cents
+        return totals
+
+    def monthly_totals(self):
+        """Return {'YYYY-MM': (income_cents, expense_cents)}."""
+        totals = {}
+        with self._lock:
+            for (year, month, _), cents in self._spent.items():
+                key = f"{year:04d}-{month:02d}"
+                income, spent = totals.get(key, (0, 0))
+                totals[key] = (income, spent + cents)
+            for (year, month), cents in self._income_by_month.items():
+                key = f"{year:04d}-{month:02d}"
+                income, spent = totals.get(key, (0, 0))
+                totals[key] = (income + cents, spent)
+        return totals
+
+    def top_merchants(self, count):
+        """Return [(merchant, cents)] of the merchants with the most spending."""
+        with self._lock:
+            return heapq.nlargest(count, self._merchant_spent.items(), key=lambda item: item[1])
+
+    def rows_for_merchants(self, tokens):
+        """Row indices of transactions whose merchant shares a token with tokens."""
+        rows = []
+        with self._lock:
+            for merchant, merchant_rows in self._merchant_rows.items():
+                if tokens.intersection(merchant.split()):
+                    rows.extend(merchant_rows)
+        return rows
+
+    def row(self, index):
+        """Return (date, description, amount_cents, category) of one row."""
+        day = self._days[index]
+        code = self._categories[index]
+        return (
+            (EPOCH_DATE + timedelta(days=day)).isoformat() if day != MISSING_DAY else '',
+            self.descriptions[index],
+            self._amounts[index],
+            self._category_names[code] if code >= 0 else 'Uncategorized'
+        )
+
+    def top_expenses(self, count):
+        """Return [(amount_cents, description)] of the largest expenses in the recent window."""
+        return [(-amount, self.descriptions[row]) for amount, _, row in self.recent_expenses.top(count)]
+
+    def recurring_charges(self, min_count, exclude_categories=()):
+        """
+        Return {merchant: [(epoch_day, cents), ...]} oldest first, for merchants
+        charged at least min_count times outside exclude_categories.
+        """
+        charges = {}
+        with self._lock:
+            excluded = {self._category_codes[c] for c in exclude_categories if c in self._category_codes}
+            for merchant, rows in self._merchant_rows.items():
+                if len(rows) < min_count:
+                    continue
+                history = sorted(
+                    (self._days[row], -self._amounts[row]) for row in rows
+                    if self._amounts[row] < 0 and self._days[row] != MISSING_DAY
+                    and self._categories[row] not in excluded
+                )
+                if len(history) >= min_count:
+                    charges[merchant] = history
+        return charges
+
+_transaction_stores = {}
+_transaction_stores_lock = threading.Lock()
+
+def get_transaction_store(user_id):
+    """Return the TransactionStore of a user, creating it on first use."""
+    with _transaction_stores_lock:
+        store = _transaction_stores.get(user_id)
+        if store is None:
+            store = _transaction_stores[user_id] = TransactionStore(
+                on_change=lambda: tip_scheduler.schedule(user_id)
+            )
+        return store
+
+def get_jwt_claims(auth_header):
+    """
+    Return the claims of a 'Bearer <token>' header, or {} if there is no valid token.
+    Tokens are verified against JWT_PUBLIC_KEY; without it every request is
+    anonymous unless JWT_ALLOW_UNVERIFIED is set for development.
+    """
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return {}
+    token = auth_header[len('Bearer '):].strip()
     try:
-        # Prepare simplified transaction data for Gemini
-        simplified_transactions = []
-        for t in transactions_to_process:
-            simplified_transactions.append({
-                "amount": t.get("amount", 0),
-                "description": t.get("description", "")
-            })
-        
-        prompt = f"""
-        Analyze the following bank transactions and assign each one a category from this list:
-        ["Salary/Income", "Groceries", "Utilities", "Rent/Mortgage", "Transport", "Shopping", "Entertainment", "Health", "Dining", "Transfers", "Other"]
-        
-        IMPORTANT: Return ONLY a valid JSON array of objects. Each object must have "description", "amount", and "category" fields.
-        Do not include any explanations, markdown, or extra text.
-        
-        Transactions:
-        {json.dumps(simplified_transactions)}
+        if JWT_PUBLIC_KEY:
+            return jwt.decode(token, JWT_PUBLIC_KEY, algorithms=JWT_ALGORITHMS, options={"verify_aud": False})
+        if JWT_ALLOW_UNVERIFIED:
+            return jwt.decode(token, options={"verify_signature": False})
+        return {}
+    except jwt.PyJWTError:
+        logger.warning("Could not decode JWT, treating request as anonymous")
+        return {}
+
+if not JWT_PUBLIC_KEY:
+    if JWT_ALLOW_UNVERIFIED:
+        logger.warning("JWT_ALLOW_UNVERIFIED is set: token signatures are NOT checked, for development only")
+    else:
+        logger.warning("JWT_PUBLIC_KEY is not set: all requests share the anonymous user's goals and budgets")
+
+def get_user_id(auth_header):
+    """Return the JWT subject of a 'Bearer <token>' header, or 'anonymous'."""
+    claims = get_jwt_claims(auth_header)
+    return str(claims.get('sub') or claims.get('user') or 'anonymous')
+
+def is_unverified_caller(user_id, auth_header):
+    """
+    True when a request carries credentials but no verified user, e.g. a bearer
+    token while JWT_PUBLIC_KEY is unset. Such callers all map to 'anonymous', so
+    their own bank data, answers and tips must never be stored under that id.
+    """
+    return user_id == 'anonymous' and bool(auth_header)
+
+def _connect_sqlite(path):
+    """Open a SQLite connection that is safe to share across threads and worker processes."""
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class MemoryStateBackend:
+    """Key-value backend kept in process memory; only suitable for a single worker."""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self._lock:
+            return self._data.get((user_id, key))
+
+    def set(self, user_id, key, value):
+        with self._lock:
+            self._data[(user_id, key)] = value
+
+    def update(self, user_id, key, apply):
+        """Replace the value with apply(current value) atomically; returns the new value."""
+        with self._lock:
+            value = self._data[(user_id, key)] = apply(self._data.get((user_id, key)))
+            return value
+
+class SQLiteStateBackend:
+    """Key-value backend in a WAL-mode SQLite file shared by all workers on a host."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = _connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_state ("
+            "user_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (user_id, key))"
+        )
+        self._conn.commit()
+
+    def get(self, user_id, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM user_state WHERE user_id = ? AND key = ?", (user_id, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, user_id, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_state (user_id, key, value) VALUES (?, ?, ?)", (user_id, key, value)
+            )
+            self._conn.commit()
+
+    def update(self, user_id, key, apply):
+        """
+        Replace the value with apply(current value) in one write transaction,
+        so read-modify-write cycles from other workers cannot interleave.
         """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM user_state WHERE user_id = ? AND key = ?", (user_id, key)
+                ).fetchone()
+                value = apply(row[0] if row else None)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO user_state (user_id, key, value) VALUES (?, ?, ?)", (user_id, key, value)
+                )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return value
+
+STATE_BACKENDS = {
+    "sqlite": lambda: SQLiteStateBackend(STATE_DB_PATH),
+    "memory": MemoryStateBackend
+}
+
+class UserStateStore:
+    """
+    Per-user JSON state (goal, budgets) on a pluggable backend.
+    Reads go through a short-lived in-process cache; writes go straight to
+    the backend so other workers see them once their cache entry expires.
+    Changes that depend on the current value must use update(), which reads
+    it from the backend rather than the cache.
+    """
+
+    def __init__(self, backend, cache_ttl):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get((user_id, key))
+        if cached and cached[0] > now:
+            value = cached[1]
+        else:
+            value = self.backend.get(user_id, key)
+            with self._lock:
+                self._cache[(user_id, key)] = (now + self.cache_ttl, value)
+        return json.loads(value) if value is not None else default
+
+    def set(self, user_id, key, value):
+        serialized = json.dumps(value)
+        self.backend.set(user_id, key, serialized)
+        with self._lock:
+            self._cache[(user_id, key)] = (time.monotonic() + self.cache_ttl, serialized)
+
+    def update(self, user_id, key, mutate, default=None):
+        """Atomically store mutate(current value, or default) and return it."""
+        def apply(serialized):
+            return json.dumps(mutate(json.loads(serialized) if serialized is not None else default))
+        serialized = self.backend.update(user_id, key, apply)
+        with self._lock:
+            self._cache[(user_id, key)] = (time.monotonic() + self.cache_ttl, serialized)
+        return json.loads(serialized)
+
+user_state = UserStateStore(STATE_BACKENDS[STATE_BACKEND](), STATE_CACHE_TTL_SECONDS)
+
+def _create_http_session():
+    """Build the pooled, retrying HTTP session used for all bank API calls."""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=BANK_POOL_SIZE, pool_maxsize=BANK_POOL_SIZE, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+http_session = _create_http_session()
+
+class TransactionLedger:
+    """
+    Local SQLite copy of each user's bank transactions plus their sync state
+    (last seen transaction, ETag, Last-Modified, time of the last sync).
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = _connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transactions ("
+            "user_id TEXT NOT NULL, transaction_key TEXT NOT NULL, date TEXT, data TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, transaction_key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (user_id, date)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            "user_id TEXT PRIMARY KEY, last_id TEXT, last_date TEXT, etag TEXT, last_modified TEXT, synced_at REAL)"
+        )
+        # Highest transactions rowid per user, so every worker can tell when rows were added
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ledger_marks (user_id TEXT PRIMARY KEY, high_water INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def transaction_key(transaction):
+        transaction_id = transaction.get('transactionId')
+        if transaction_id is not None:
+            return str(transaction_id)
+        return hashlib.sha1(json.dumps(transaction, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def add(self, user_id, transactions):
+        """Persist transactions; returns those that were not stored yet."""
+        added = []
+        high_water = 0
+        with self._lock:
+            for t in transactions:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO transactions (user_id, transaction_key, date, data) VALUES (?, ?, ?, ?)",
+                    (user_id, self.transaction_key(t), t.get('date'), json.dumps(t))
+                )
+                if cursor.rowcount:
+                    added.append(t)
+                    high_water = max(high_water, cursor.lastrowid)
+            if added:
+                self._conn.execute(
+                    "INSERT INTO ledger_marks (user_id, high_water) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET high_water = MAX(high_water, excluded.high_water)",
+                    (user_id, high_water)
+                )
+            self._conn.commit()
+        return added
+
+    def load(self, user_id, after=0):
+        """
+        Return (transactions, high_water): the user's stored transactions with
+        a rowid above after, newest first, and the highest rowid among them.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, data FROM transactions WHERE user_id = ? AND rowid > ? ORDER BY date DESC",
+                (user_id, after)
+            ).fetchall()
+        high_water = max((row[0] for row in rows), default=after)
+        return [json.loads(row[1]) for row in rows], high_water
+
+    def high_water(self, user_id):
+        """Highest rowid stored for the user, as recorded by add()."""
+        with self._lock:
+            row = self._conn.execute("SELECT high_water FROM ledger_marks WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_sync_state(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_id, last_date, etag, last_modified, synced_at FROM sync_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        keys = ('last_id', 'last_date', 'etag', 'last_modified', 'synced_at')
+        return dict(zip(keys, row)) if row else dict.fromkeys(keys)
+
+    def set_sync_state(self, user_id, state):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (user_id, last_id, last_date, etag, last_modified, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, state['last_id'], state['last_date'], state['etag'], state['last_modified'], state['synced_at'])
+            )
+            self._conn.commit()
+
+transaction_ledger = TransactionLedger(LEDGER_DB_PATH)
+
+# In-process copy of each user's ledger as (high_water, rows newest first)
+_ledger_cache = {}
+_sync_locks = {}
+_sync_locks_lock = threading.Lock()
+
+def _fetch_transaction_pages(url, auth_header, state):
+    """
+    Fetch new transactions from the bank API, page by page.
+    Sends the last seen transaction as 'since_id' together with
+    If-None-Match / If-Modified-Since; a 304 answer means nothing changed.
+    Returns (transactions, etag, last_modified).
+    """
+    headers = {'Accept': 'application/json'}
+    if auth_header:
+        headers['Authorization'] = auth_header
+    if state['etag']:
+        headers['If-None-Match'] = state['etag']
+    if state['last_modified']:
+        headers['If-Modified-Since'] = state['last_modified']
+    
+    params = {'limit': BANK_PAGE_SIZE}
+    if state['last_id'] is not None:
+        params['since_id'] = state['last_id']
+    
+    fetched = []
+    etag, last_modified = state['etag'], state['last_modified']
+    first_page = True
+    while True:
+        response = http_session.get(url, headers=headers, params=params, timeout=BANK_TIMEOUT_SECONDS)
+        if response.status_code == 304:
+            break
+        response.raise_for_status()
+        if first_page:
+            etag = response.headers.get('ETag', etag)
+            last_modified = response.headers.get('Last-Modified', last_modified)
+            headers.pop('If-None-Match', None)
+            headers.pop('If-Modified-Since', None)
+            first_page = False
         
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
+        payload = response.json()
+        page = payload.get('transactions', []) if isinstance(payload, dict) else payload
+        fetched.extend(page)
+        next_cursor = payload.get('next_cursor') if isinstance(payload, dict) else None
+        if next_cursor:
+            params['cursor'] = next_cursor
+        elif isinstance(payload, list) and len(page) >= BANK_PAGE_SIZE:
+            params['offset'] = params.get('offset', 0) + len(page)
+        else:
+            break
+    return fetched, etag, last_modified
+
+def sync_transactions(user_id, auth_header):
+    """
+    Bring the local ledger of a user up to date with the bank API.
+    At most one sync per user runs at a time, and none runs if the last one
+    is younger than BANK_SYNC_INTERVAL_SECONDS. Returns the new transactions.
+    """
+    with _sync_locks_lock:
+        lock = _sync_locks.setdefault(user_id, threading.Lock())
+    with lock:
+        state = transaction_ledger.get_sync_state(user_id)
+        if state['synced_at'] and time.time() - state['synced_at'] < BANK_SYNC_INTERVAL_SECONDS:
+            metrics.inc("copilot_bank_sync_total", outcome='fresh')
+            return []
         
-        # Use regex to extract JSON array from response
-        json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-        if not json_match:
-            raise ValueError("No valid JSON array found in Gemini response")
+        account = get_jwt_claims(auth_header).get('acct', user_id)
+        url = BANK_API_URL.format(account=account, user=user_id)
+        with stage_timer('bank_sync'):
+            fetched, etag, last_modified = _fetch_transaction_pages(url, auth_header, state)
+        added = transaction_ledger.add(user_id, fetched)
+        metrics.inc("copilot_bank_sync_total", outcome='updated' if added else 'unchanged')
         
-        categorized_list = json.loads(json_match.group(0))
+        if fetched:
+            newest = max(fetched, key=lambda t: str(t.get('date', '')))
+            if newest.get('transactionId') is not None:
+                state['last_id'] = str(newest['transactionId'])
+            state['last_date'] = newest.get('date', state['last_date'])
+        state.update(etag=etag, last_modified=last_modified, synced_at=time.time())
+        transaction_ledger.set_sync_state(user_id, state)
         
-        # Create mapping from (description, amount) to category
-        category_mapping = {}
-        for item in categorized_list:
-            key = (item.get('description'), item.get('amount'))
-            category_mapping[key] = item.get('category', 'Other')
+        if added:
+            logger.info("Synced %d new transactions for user %s", len(added), user_id)
+        return added
+
+def get_transactions(auth_header):
+    """
+    Return the user's transactions, newest first, from the local ledger.
+    The ledger is synced incrementally from BANK_API_URL when it is stale;
+    without BANK_API_URL the hardcoded demo transactions are returned.
+    """
+    if not BANK_API_URL:
+        return [dict(t) for t in SAMPLE_TRANSACTIONS]
+    
+    user_id = get_user_id(auth_header)
+    if is_unverified_caller(user_id, auth_header):
+        return fetch_transactions_unsaved(auth_header)
+    try:
+        sync_transactions(user_id, auth_header)
+    except (requests.RequestException, ValueError) as e:
+        logger.exception("Error syncing transactions, serving the local copy")
+        metrics.inc("copilot_bank_sync_total", outcome='error')
+    return get_ledger_transactions(user_id)
+
+def fetch_transactions_unsaved(auth_header):
+    """
+    Fetch a caller's whole history from the bank without touching the ledger.
+    Used for unverified callers, whose rows would otherwise land in the ledger
+    shared by every anonymous request.
+    """
+    state = dict.fromkeys(('last_id', 'last_date', 'etag', 'last_modified', 'synced_at'))
+    url = BANK_API_URL.format(account='anonymous', user='anonymous')
+    try:
+        with stage_timer('bank_sync'):
+            fetched, _, _ = _fetch_transaction_pages(url, auth_header, state)
+    except (requests.RequestException, ValueError) as e:
+        logger.exception("Error fetching transactions for an unverified caller")
+        metrics.inc("copilot_bank_sync_total", outcome='error')
+        return []
+    metrics.inc("copilot_bank_sync_total", outcome='unsaved')
+    return sorted(fetched, key=lambda t: str(t.get('date', '')), reverse=True)
+
+def get_ledger_transactions(user_id):
+    """
+    Return the user's ledger rows, newest first, from the in-process copy.
+    The copy is extended whenever the ledger's high-water mark moves, so rows
+    synced by another worker process are picked up as well as this one's.
+    """
+    high_water = transaction_ledger.high_water(user_id)
+    with _sync_locks_lock:
+        cached = _ledger_cache.get(user_id)
+        if cached is not None and high_water <= cached[0]:
+            return cached[1]
+        if cached is None:
+            rows, mark = transaction_ledger.load(user_id)
+        else:
+            new_rows, mark = transaction_ledger.load(user_id, after=cached[0])
+            rows = new_rows + cached[1]
+        _ledger_cache[user_id] = (mark, rows)
+        return rows
+
+def _subscription_price(history):
+    """
+    Return the usual price of a charge history that looks like a subscription,
+    or None. Charges before the latest one must be near-constant in amount,
+    and all of them must come at a regular interval of at least a week.
+    """
+    previous = sorted(cents for _, cents in history[:-1])
+    typical = previous[len(previous) // 2]
+    if typical <= 0 or any(abs(cents - typical) > typical * SUBSCRIPTION_AMOUNT_TOLERANCE for cents in previous):
+        return None
+    
+    gaps = sorted(later[0] - earlier[0] for earlier, later in zip(history, history[1:]))
+    interval = gaps[len(gaps) // 2]
+    if interval < SUBSCRIPTION_MIN_INTERVAL_DAYS:
+        return None
+    if any(abs(gap - interval) > interval * SUBSCRIPTION_INTERVAL_TOLERANCE for gap in gaps):
+        return None
+    return typical
+
+def compute_tips(user_id, store):
+    """
+    Build the proactive tips of a user, most important first:
+    budget overruns, subscription price spikes, then the largest recent expense.
+    """
+    tips = []
+    now = datetime.now()
+    
+    for category, budget_amount in user_state.get(user_id, 'budgets', {}).items():
+        spent = store.category_spent(now.year, now.month, category) / 100.0
+        if spent > budget_amount:
+            tips.append({
+                'type': 'budget_overrun',
+                'text': f"Heads up! You've spent ${spent:.2f} on {category} this month, ${spent - budget_amount:.2f} over your ${budget_amount:.2f} budget."
+            })
+    
+    recurring = store.recurring_charges(SUBSCRIPTION_MIN_CHARGES, SUBSCRIPTION_EXCLUDED_CATEGORIES)
+    for merchant, history in recurring.items():
+        typical = _subscription_price(history)
+        latest = history[-1][1]
+        if typical and latest >= typical * SUBSCRIPTION_SPIKE_RATIO:
+            tips.append({
+                'type': 'subscription_spike',
+                'text': f"Your {merchant} charge went up from about ${typical / 100:.2f} to ${latest / 100:.2f}. It may be worth checking your plan."
+            })
+    
+    for amount_cents, description in store.top_expenses(1):
+        tips.append({
+            'type': 'largest_expense',
+            'text': f"I noticed your largest expense in the last {TIP_WINDOW_DAYS} days was ${amount_cents / 100.0:.2f} for {description}. Consider reviewing if this aligns with your financial goals."
+        })
+    
+    return tips
+
+class TipScheduler:
+    """
+    Background thread that recomputes users' proactive tips.
+    Users are queued whenever their transactions change and refreshed
+    periodically so the expense window keeps sliding. Results are saved
+    in user_state for the proactive tip endpoint to read.
+    """
+
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._pending = {}
+        self._known_users = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, user_id, auth_header=None):
+        """Queue a user for recomputation, fetching their transactions first if auth_header is given."""
+        with self._condition:
+            if auth_header or user_id not in self._pending:
+                self._pending[user_id] = auth_header
+            self._known_users.add(user_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tip-scheduler", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        next_refresh = time.monotonic() + self.refresh_seconds
+        while True:
+            with self._condition:
+                while not self._pending:
+                    remaining = next_refresh - time.monotonic()
+                    if remaining <= 0:
+                        self._pending = {user_id: None for user_id in self._known_users}
+                        next_refresh = time.monotonic() + self.refresh_seconds
+                        break
+                    self._condition.wait(remaining)
+                pending, self._pending = self._pending, {}
+            
+            for user_id, auth_header in pending.items():
+                try:
+                    self.refresh(user_id, auth_header)
+                except Exception as e:
+                    logger.exception("Error computing proactive tips")
+
+    def refresh(self, user_id, auth_header=None):
+        """
+        Recompute and save the tips of one user.
+        Without an auth header the store is first brought up to date from the
+        shared ledger, which may hold rows synced by other workers (a cheap
+        read of the rows above the ledger's high-water mark), so this worker
+        never overwrites newer tips with ones from a stale store.
+        Nothing is saved while no transactions could be loaded, so the tip
+        endpoint keeps asking for a fetch instead of caching an empty list.
+        """
+        store = get_transaction_store(user_id)
+        if auth_header or not BANK_API_URL:
+            transactions_data = get_transactions(auth_header)
+        else:
+            transactions_data = get_ledger_transactions(user_id)
+        if isinstance(transactions_data, list):
+            store.ingest(transactions_data)
+            categorize_pending(transactions_data, store, get_model(), user_id)
+        if not len(store):
+            logger.info("No transactions loaded for user %s yet, not saving tips", user_id)
+            return
+        user_state.set(user_id, 'tips', compute_tips(user_id, store))
+
+tip_scheduler = TipScheduler(TIP_REFRESH_SECONDS)
+
+def _normalize_description(description):
+    """Lowercase a description and collapse punctuation and whitespace."""
+    return " ".join(re.sub(r'[^a-z0-9]+', ' ', str(description or '').lower()).split())
+
+def _merchant_key(description):
+    """Normalized description without numeric tokens such as store or card numbers."""
+    return " ".join(token for token in _normalize_description(description).split() if not token.isdigit())
+
+class CategoryCache:
+    """
+    SQLite-backed cache of assigned categories.
+    Entries are keyed by (user, transactionId) and by normalized (description, amount),
+    and the least recently used entries are evicted past max_entries.
+    """
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = _connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS category_cache ("
+            "key TEXT PRIMARY KEY, category TEXT NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON category_cache (last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT MAX(last_used) FROM category_cache").fetchone()
+        self._clock = row[0] or 0
+
+    @staticmethod
+    def keys_for(transaction, user_id):
+        """
+        Return the cache keys for a transaction, most specific first.
+        Bank ids are only unique per account, so the id key is scoped to the
+        user and left out when user_id is None; the description key is shared
+        by everyone.
+        """
+        keys = []
+        if user_id is not None and transaction.get('transactionId') is not None:
+            keys.append(f"id:{user_id}:{transaction['transactionId']}")
+        keys.append(f"desc:{_normalize_description(transaction.get('description'))}|{transaction.get('amount', 0)}")
+        return keys
+
+    def lookup(self, transactions, user_id):
+        """Return a list of cached categories (or None) aligned with transactions."""
+        wanted = {key for t in transactions for key in self.keys_for(t, user_id)}
+        found = {}
+        with self._lock:
+            wanted = list(wanted)
+            for i in range(0, len(wanted), 500):
+                chunk = wanted[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, category FROM category_cache WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+
+            results = []
+            used = []
+            misses = 0
+            for t in transactions:
+                category = None
+                for key in self.keys_for(t, user_id):
+                    if key in found:
+                        category = found[key]
+                        used.append(key)
+                        break
+                if category is None:
+                    misses += 1
+                results.append(category)
+            self.misses += misses
+            self.hits += len(transactions) - misses
+            metrics.inc("copilot_category_cache_misses_total", misses)
+            metrics.inc("copilot_category_cache_hits_total", len(transactions) - misses)
+
+            if used:
+                self._clock += 1
+                self._conn.executemany(
+                    "UPDATE category_cache SET last_used = ? WHERE key = ?",
+                    [(self._clock, key) for key in used]
+                )
+                self._conn.commit()
+        return results
+
+    def store(self, transactions, user_id):
+        """Remember the 'category' of each transaction under all of its keys."""
+        with self._lock:
+            self._clock += 1
+            rows = [
+                (key, t['category'], self._clock)
+                for t in transactions if t.get('category')
+                for key in self.keys_for(t, user_id)
+            ]
+            if not rows:
+                return
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO category_cache (key, category, last_used) VALUES (?, ?, ?)", rows
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM category_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM category_cache WHERE key IN "
+                    "(SELECT key FROM category_cache ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM category_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size
+        }
+
+category_cache = CategoryCache(CATEGORY_CACHE_PATH, CATEGORY_CACHE_MAX_ENTRIES)
+
+class MerchantMatcher:
+    """
+    Token trie over normalized merchant phrases.
+    The longest phrase found anywhere in a description decides its category.
+    Rules learned from Gemini answers are persisted next to the category cache.
+    """
+
+    def __init__(self, rules, path=None):
+        self._root = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        for phrase, category in rules.items():
+            self._insert(phrase, category)
+        if path:
+            self._conn = _connect_sqlite(path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS merchant_rules (phrase TEXT PRIMARY KEY, category TEXT NOT NULL)"
+            )
+            self._conn.commit()
+            for phrase, category in self._conn.execute("SELECT phrase, category FROM merchant_rules"):
+                self._insert(phrase, category)
+
+    def _insert(self, phrase, category):
+        tokens = _normalize_description(phrase).split()
+        if not tokens:
+            return
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[None] = category
+
+    def match(self, description):
+        """Return the category for a description, or None when no rule applies."""
+        tokens = _normalize_description(description).split()
+        best_category = None
+        best_length = 0
+        for start in range(len(tokens)):
+            node = self._root
+            for offset in range(start, len(tokens)):
+                node = node.get(tokens[offset])
+                if node is None:
+                    break
+                if None in node and offset - start + 1 > best_length:
+                    best_category = node[None]
+                    best_length = offset - start + 1
+        return best_category
+
+    def learn(self, transactions):
+        """Add a rule for each categorized description no existing rule covers."""
+        learned = []
+        with self._lock:
+            for t in transactions:
+                category = t.get('category')
+                if category not in CATEGORIES or category == 'Other':
+                    continue
+                phrase = _merchant_key(t.get('description'))
+                if phrase and self.match(phrase) is None:
+                    self._insert(phrase, category)
+                    learned.append((phrase, category))
+            if learned and self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO merchant_rules (phrase, category) VALUES (?, ?)", learned
+                )
+                self._conn.commit()
+        if learned:
+            logger.info("Learned %d merchant rules", len(learned))
+
+merchant_matcher = MerchantMatcher(DEFAULT_MERCHANT_RULES, CATEGORY_CACHE_PATH)
+
+class _FlightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution."""
+
+    def __init__(self, name):
+        self.name = name
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run fn, or wait for and share the result of an identical call already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+            else:
+                self.coalesced += 1
+                metrics.inc("copilot_coalesced_calls_total", flight=self.name)
         
-        # Apply categories to original transactions
-        for transaction in transactions_data:
-            key = (transaction.get('description'), transaction.get('amount'))
-            transaction['category'] = category_mapping.get(key, 'Other')
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
         
-        logger.info("Successfully categorized transactions")
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+class AnswerCache:
+    """In-process LRU cache of model answers with a time-to-live."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(user_id, question, snapshot_id):
+        """Key an answer by user, normalized question and transaction snapshot."""
+        raw = f"{user_id}\x00{_normalize_description(question)}\x00{snapshot_id}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                metrics.inc("copilot_answer_cache_misses_total")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("copilot_answer_cache_hits_total")
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS)
+answer_flight = SingleFlight('answer')
+categorize_flight = SingleFlight('categorize')
+
+def _categorize_chunk(chunk, model):
+    """
+    Ask Gemini to categorize one chunk of (id, transaction) pairs.
+    Returns a mapping from id to category, retrying failed calls.
+    """
+    simplified_transactions = []
+    for transaction_id, t in chunk:
+        simplified_transactions.append({
+            "id": transaction_id,
+            "amount": t.get("amount", 0),
+            "description": t.get("description", "")
+        })
+    
+    prompt = f"""
+    Analyze the following bank transactions and assign each one a category from this list:
+    {json.dumps(CATEGORIES)}
+    
+    IMPORTANT: Return ONLY a valid JSON array of objects. Each object must have "id" and "category" fields,
+    with "id" copied unchanged from the input.
+    Do not include any explanations, markdown, or extra text.
+    
+    Transactions:
+    {json.dumps(simplified_transactions)}
+    """
+    
+    last_error = None
+    prompt_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    for attempt in range(CATEGORIZE_RETRIES + 1):
+        try:
+            # Identical batches from concurrent requests share one model call
+            response = categorize_flight.do(prompt_key, lambda: model.generate_content(prompt, purpose='categorize'))
+            response_text = response.text.strip()
+            
+            # Use regex to extract JSON array from response
+            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+            if not json_match:
+                raise ValueError("No valid JSON array found in Gemini response")
+            
+            categorized_list = json.loads(json_match.group(0))
+            return {
+                str(item.get('id')): item.get('category', 'Other')
+                for item in categorized_list if isinstance(item, dict)
+            }
+        except Exception as e:
+            last_error = e
+            logger.warning("Categorization chunk failed (attempt %d): %s", attempt + 1, e)
+            if attempt < CATEGORIZE_RETRIES:
+                metrics.inc("copilot_categorization_retries_total")
+    raise last_error
+
+def categorize_transactions(transactions_data, model, user_id):
+    """
+    Categorize transactions using Gemini AI.
+    Categories already in the cache are reused and known merchants are matched
+    locally; the remaining transactions are split into chunks that are sent to
+    Gemini in parallel, and the results are cached and learned as merchant rules.
+    """
+    if not isinstance(transactions_data, list) or not transactions_data or not model:
         return transactions_data
-        
-    except Exception as e:
-        logger.exception("Error categorizing transactions")
-        # Fallback: assign 'Uncategorized' to all transactions
-        for transaction in transactions_data:
-            transaction['category'] = 'Uncategorized'
+    
+    cached_categories = category_cache.lookup(transactions_data, user_id)
+    uncached = []
+    rule_matches = 0
+    for transaction, category in zip(transactions_data, cached_categories):
+        if category is None:
+            category = merchant_matcher.match(transaction.get('description'))
+            if category is not None:
+                rule_matches += 1
+        if category is not None:
+            transaction['category'] = category
+        else:
+            uncached.append(transaction)
+    
+    metrics.inc("copilot_categorized_transactions_total", len(transactions_data) - len(uncached) - rule_matches, source='cache')
+    metrics.inc("copilot_categorized_transactions_total", rule_matches, source='rules')
+    if not uncached:
         return transactions_data
+    
+    # Key every transaction by its transactionId, falling back to its position
+    keyed = []
+    for index, t in enumerate(uncached):
+        transaction_id = t.get('transactionId')
+        keyed.append((str(transaction_id) if transaction_id is not None else f"row-{index}", t))
+    
+    chunks = [keyed[i:i + CATEGORIZE_CHUNK_SIZE] for i in range(0, len(keyed), CATEGORIZE_CHUNK_SIZE)]
+    futures = [(chunk, categorize_executor.submit(_categorize_chunk, chunk, model)) for chunk in chunks]
+    
+    answered = []
+    failed_chunks = 0
+    for chunk, future in futures:
+        try:
+            category_mapping = future.result()
+        except Exception as e:
+            logger.exception("Error categorizing transactions")
+            failed_chunks += 1
+            # Fallback: assign 'Uncategorized' to this chunk only
+            for _, transaction in chunk:
+                transaction['category'] = 'Uncategorized'
+            metrics.inc("copilot_categorization_fallback_total", len(chunk), fallback='Uncategorized')
+            continue
+        
+        for transaction_id, transaction in chunk:
+            if transaction_id in category_mapping:
+                transaction['category'] = category_mapping[transaction_id]
+                answered.append(transaction)
+            else:
+                transaction['category'] = 'Other'
+                metrics.inc("copilot_categorization_fallback_total", fallback='Other')
+    
+    # Only cache and learn from what Gemini actually answered
+    metrics.inc("copilot_categorized_transactions_total", len(answered), source='model')
+    category_cache.store(answered, user_id)
+    merchant_matcher.learn(answered)
+    
+    logger.info("Categorized %d transactions in %d chunks (%d failed)", len(uncached), len(chunks), failed_chunks)
+    return transactions_data
+
+def categorize_pending(transactions_data, store, model, user_id):
+    """Categorize the rows that have no category yet and update the store with them."""
+    # Ledger rows keep their category between requests; only new or failed ones need work
+    pending = [t for t in transactions_data if t.get('category') in (None, 'Uncategorized')]
+    if pending:
+        categorize_transactions(pending, model, user_id)
+        store.set_categories(pending)
 
 def extract_goal_from_message(user_message, model):
     """Extract goal name and target amount from user message."""
@@ -125,7 +1695,7 @@ def extract_goal_from_message(user_message, model):
         If you cannot extract both pieces of information, return: {{}}
         """
         
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, purpose='extract_goal')
         response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
         
         goal_data = json.loads(response_text)
@@ -152,7 +1722,7 @@ def extract_budget_from_message(user_message, model):
         If you cannot extract both pieces of information, return: {{}}
         """
         
-        response = model.generate_content(prompt)
+        response = model.generate_content(prompt, purpose='extract_budget')
         response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
         
         budget_data = json.loads(response_text)
@@ -164,6 +1734,177 @@ def extract_budget_from_message(user_message, model):
         logger.exception("Error extracting budget from message")
         return None
 
+# Amounts like "$1,000", "1000.50", "$2k" or "1.5 thousand"
+AMOUNT_PATTERN = re.compile(
+    r'(?<!\w)(?<!\d\.)(\$)?\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d+)?\s?(k|thousand)?(?!\w|\.\d)',
+    re.IGNORECASE
+)
+
+# The thing a goal is for: "... for a new car", stopping at punctuation or a trailing clause
+GOAL_NAME_PATTERN = re.compile(
+    r"\bfor\s+(?:a|an|my|the|our)?\s*([a-z][a-z' -]*?)\s*(?=$|[.,!?;]|\s(?:by|in|within|before|with)\b)",
+    re.IGNORECASE
+)
+
+def _category_aliases():
+    """Map every spelling we accept for a budget category to its name."""
+    aliases = {}
+    for category in CATEGORIES:
+        for part in category.lower().split('/'):
+            aliases[part] = category
+            if part.endswith('ies'):
+                aliases[part[:-3] + 'y'] = category
+            elif part.endswith('s'):
+                aliases[part[:-1]] = category
+    aliases.update({
+        "restaurants": "Dining", "restaurant": "Dining", "eating out": "Dining", "takeout": "Dining",
+        "transportation": "Transport", "gas": "Transport", "fuel": "Transport",
+        "bills": "Utilities", "housing": "Rent/Mortgage", "clothes": "Shopping", "clothing": "Shopping",
+        "fun": "Entertainment", "subscriptions": "Entertainment", "medical": "Health", "healthcare": "Health"
+    })
+    return aliases
+
+CATEGORY_ALIASES = _category_aliases()
+CATEGORY_PATTERN = re.compile(
+    r'\b(' + '|'.join(re.escape(alias) for alias in sorted(CATEGORY_ALIASES, key=len, reverse=True)) + r')\b',
+    re.IGNORECASE
+)
+
+def parse_amount(text):
+    """
+    Return the amount mentioned in text as a float, or None.
+    Amounts marked with '$' or 'k' win over bare numbers.
+    """
+    candidates = []
+    for match in AMOUNT_PATTERN.finditer(text):
+        dollar, whole, fraction, multiplier = match.groups()
+        value = float(whole.replace(',', '') + (fraction or ''))
+        if multiplier:
+            value *= 1000
+        candidates.append((bool(dollar or multiplier), value))
+    marked = [value for is_marked, value in candidates if is_marked]
+    if marked:
+        return marked[0]
+    if len(candidates) == 1:
+        return candidates[0][1]
+    return None
+
+def parse_goal_locally(user_message):
+    """Extract goal name and target amount without calling the model, or return None."""
+    amount = parse_amount(user_message)
+    match = GOAL_NAME_PATTERN.search(user_message)
+    if amount is None or amount <= 0 or not match:
+        return None
+    name = match.group(1).strip()
+    if not name:
+        return None
+    return {"name": name, "target_amount": amount}
+
+def parse_budget_locally(user_message):
+    """Extract budget category and amount without calling the model, or return None."""
+    amount = parse_amount(user_message)
+    categories = {CATEGORY_ALIASES[m.group(1).lower()] for m in CATEGORY_PATTERN.finditer(user_message)}
+    if amount is None or amount <= 0 or len(categories) != 1:
+        return None
+    return {"category": categories.pop(), "amount": amount}
+
+MONTH_NAMES = {
+    name: number for number, names in enumerate(
+        (("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+         ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+         ("november", "nov"), ("december", "dec")), start=1
+    ) for name in names
+}
+
+QUESTION_STOPWORDS = {
+    "the", "and", "for", "did", "how", "much", "what", "when", "where", "which", "who", "was", "were",
+    "spend", "spent", "spending", "money", "have", "has", "had", "last", "this", "that", "month", "year",
+    "my", "on", "at", "in", "of", "to", "is", "are", "do", "does", "most", "many", "all", "any", "with"
+}
+
+def _select_question_rows(store, question, limit):
+    """Return up to limit row indices relevant to a question and up to limit other recent rows, newest first."""
+    question_lower = question.lower()
+    tokens = {
+        token for token in _normalize_description(question_lower).split()
+        if len(token) > 2 and token not in QUESTION_STOPWORDS and token not in MONTH_NAMES
+    }
+    relevant = set(store.rows_for_merchants(tokens)) if tokens else set()
+    
+    for match in CATEGORY_PATTERN.finditer(question_lower):
+        relevant.update(store.rows_for_category(CATEGORY_ALIASES[match.group(1).lower()]).tolist())
+    
+    months = {MONTH_NAMES[word] for word in re.findall(r'[a-z]+', question_lower) if word in MONTH_NAMES}
+    for year, month in store.months():
+        if month in months:
+            relevant.update(store.rows_for_month(year, month).tolist())
+    
+    # Rows are short, so more than limit rows can never fit in the prompt anyway
+    days = store.columns()[1]
+    relevant_rows = sorted(relevant, key=lambda row: days[row], reverse=True)[:limit]
+    newest = np.argpartition(-days, limit - 1)[:limit] if len(days) > limit else np.arange(len(days))
+    newest = newest[np.argsort(-days[newest], kind='stable')]
+    recent_rows = [int(row) for row in newest if int(row) not in relevant]
+    return relevant_rows, recent_rows
+
+def build_qa_context(store, question, token_budget):
+    """
+    Build a compact transaction summary for a Q&A prompt.
+    Sections are added in order of importance: overall totals, category and
+    recent monthly totals, top merchants, then transaction rows relevant to
+    the question and the most recent rows, until the token budget is used up.
+    Returns (context_text, context_stats).
+    """
+    char_budget = token_budget * CHARS_PER_TOKEN
+    sections = []
+    used = 0
+    
+    def add(text):
+        nonlocal used
+        if used + len(text) + 1 > char_budget:
+            return False
+        sections.append(text)
+        used += len(text) + 1
+        return True
+    
+    if not len(store):
+        return "No transaction data available.", {"chars": 0, "estimated_tokens": 0, "rows": 0}
+    
+    monthly = store.monthly_totals()
+    income = sum(month_income for month_income, _ in monthly.values())
+    spent = sum(month_spent for _, month_spent in monthly.values())
+    add(f"{len(store)} transactions | total income ${income / 100:.2f} | total spending ${spent / 100:.2f} | amounts in dollars, negative = expense")
+    
+    category_totals = sorted(store.category_totals().items(), key=lambda item: item[1], reverse=True)
+    add("Spending by category: " + "; ".join(f"{category} {cents / 100:.2f}" for category, cents in category_totals))
+    
+    recent_months = sorted(monthly, reverse=True)[:SUMMARY_MONTH_COUNT]
+    add("Monthly income/spending, newest first: " + "; ".join(
+        f"{month} {monthly[month][0] / 100:.2f}/{monthly[month][1] / 100:.2f}" for month in recent_months
+    ))
+    
+    merchants = store.top_merchants(TOP_MERCHANT_COUNT)
+    if merchants:
+        add("Top merchants by spending: " + "; ".join(f"{merchant} {cents / 100:.2f}" for merchant, cents in merchants))
+    
+    relevant_rows, recent_rows = _select_question_rows(store, question, max(1, char_budget // 16))
+    row_count = 0
+    if add("Transactions relevant to the question, then most recent (date|description|amount|category):"):
+        for row in relevant_rows + recent_rows:
+            day, description, amount, category = store.row(row)
+            if not add(f"{day}|{description}|{amount / 100:.2f}|{category}"):
+                break
+            row_count += 1
+    
+    context_text = "\n".join(sections)
+    context_stats = {
+        "chars": len(context_text),
+        "estimated_tokens": len(context_text) // CHARS_PER_TOKEN + 1,
+        "rows": row_count
+    }
+    logger.info("Q&A prompt context: %d chars, ~%d tokens, %d rows", context_stats["chars"], context_stats["estimated_tokens"], row_count)
+    return context_text, context_stats
+
 @app.route('/')
 def index():
     """Serve the main page."""
@@ -171,254 +1912,403 @@ def index():
 
 @app.route('/api/proactive_tip', methods=['POST'])
 def proactive_tip_endpoint():
-    """Find the largest expense in the last 30 days and return a helpful tip."""
+    """Return the precomputed proactive tip for the user; tips are built by the tip scheduler."""
     try:
-        model = configure_gemini()
-        if not model:
-            return jsonify({}), 200
-        
         auth_header = request.headers.get('Authorization')
-        transactions_data = get_transactions(auth_header)
-        
-        if not transactions_data:
-            return jsonify({}), 200
+        user_id = get_user_id(auth_header)
+        if is_unverified_caller(user_id, auth_header):
+            # Never read or save tips under the shared anonymous id; compute them for this caller only
+            store = TransactionStore()
+            transactions_data = get_transactions(auth_header)
+            store.ingest(transactions_data)
+            categorize_pending(transactions_data, store, get_model(), None)
+            tips = compute_tips(user_id, store)
+            return jsonify({'tip': tips[0]['text'], 'tips': tips} if tips else {}), 200
         
-        # Find transactions from last 30 days
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        recent_expenses = []
+        tips = user_state.get(user_id, 'tips')
         
-        for transaction in transactions_data:
-            try:
-                date_str = transaction.get('date', '')
-                if date_str:
-                    transaction_date = datetime.fromisoformat(date_str.split('T')[0])
-                    amount = transaction.get('amount', 0)
-                    
-                    # Only consider expenses (negative amounts) from last 30 days
-                    if transaction_date >= thirty_days_ago and amount < 0:
-                        recent_expenses.append({
-                            'amount': abs(amount),
-                            'description': transaction.get('description', ''),
-                            'date': date_str
-                        })
-            except (ValueError, TypeError):
-                continue
-        
-        if not recent_expenses:
+        if tips is None:
+            # Not computed yet: fetch and compute in the background for the next page load
+            tip_scheduler.schedule(user_id, auth_header)
             return jsonify({}), 200
         
-        # Find the largest expense
-        largest_expense = max(recent_expenses, key=lambda x: x['amount'])
-        amount_dollars = largest_expense['amount'] / 100.0
-        
-        tip = f"I noticed your largest expense in the last 30 days was ${amount_dollars:.2f} for {largest_expense['description']}. Consider reviewing if this aligns with your financial goals."
+        if not tips:
+            return jsonify({}), 200
         
-        return jsonify({'tip': tip}), 200
+        return jsonify({'tip': tips[0]['text'], 'tips': tips}), 200
         
     except Exception as e:
         logger.exception("Error in proactive_tip_endpoint")
         return jsonify({}), 200
 
-@app.route('/api/chat', methods=['POST'])
-def chat_endpoint():
+@app.route('/api/aggregates', methods=['GET'])
+def aggregates_endpoint():
     """
-    Main chat endpoint with robust error handling and complete logic.
-    CRITICAL: Every logical path MUST end with a return statement.
+    Return monthly spending per category, budget usage and goal progress.
+    Spending of rows that could not be categorized is reported under
+    'Uncategorized', and their count as uncategorized_transactions.
     """
     try:
-        # Step 1: Initialize Gemini model
-        model = configure_gemini()
-        if not model:
-            return jsonify({"error": "AI service is currently unavailable. Please try again later."}), 500
+        # Categorize through the same stages as chat so per-category totals are complete
+        chat = ChatRequest('', request.headers.get('Authorization'))
+        chat.resolve(('categories', 'aggregates'))
+        user_id = chat.user_id
+        transaction_store = chat.aggregates
+        transactions_data = chat.categorized_transactions
+        uncategorized = 0
+        if isinstance(transactions_data, list):
+            uncategorized = sum(1 for t in transactions_data if t.get('category') in (None, 'Uncategorized'))
         
-        # Step 2: Get user message
-        data = request.get_json()
-        if not data or 'message' not in data:
-            return jsonify({'error': "Invalid request: missing 'message' field"}), 400
+        user_goal = user_state.get(user_id, 'goal', {})
+        user_budgets = user_state.get(user_id, 'budgets', {})
         
-        user_message = data['message']
-        user_message_lower = user_message.lower()
+        spending = {
+            month: {category: cents / 100.0 for category, cents in categories.items()}
+            for month, categories in transaction_store.monthly_spending().items()
+        }
         
-        # Step 3: Fetch raw transaction data
-        auth_header = request.headers.get('Authorization')
-        transactions_data = get_transactions(auth_header)
+        now = datetime.now()
+        budgets = {}
+        for category, amount in user_budgets.items():
+            budgets[category] = {
+                'budget': amount,
+                'spent': transaction_store.category_spent(now.year, now.month, category) / 100.0
+            }
         
-        # Step 4: IMMEDIATELY categorize transactions
-        transactions_data = categorize_transactions(transactions_data, model)
+        goal = {}
+        if user_goal:
+            goal_start_date = _parse_date(user_goal.get('start_date'))
+            start_day = _epoch_day(goal_start_date) if goal_start_date else None
+            goal = {
+                'name': user_goal.get('name'),
+                'target': user_goal.get('target', 0),
+                'saved': transaction_store.income_since(start_day) / 100.0
+            }
         
-        # Step 5: Intent handling with if/elif/else structure
+        return jsonify({
+            'spending': spending,
+            'budgets': budgets,
+            'goal': goal,
+            'uncategorized_transactions': uncategorized
+        }), 200
         
-        # Intent 1: Set Goal
-        if any(keyword in user_message_lower for keyword in ["set a goal", "i want to save", "save for", "goal to save"]):
-            try:
-                goal_data = extract_goal_from_message(user_message, model)
-                if goal_data:
-                    user_goal['name'] = goal_data['name']
-                    user_goal['target'] = float(goal_data['target_amount'])
-                    user_goal['start_date'] = datetime.now().isoformat()
-                    reply_text = f"Perfect! I've set a savings goal of ${user_goal['target']:.2f} for your {user_goal['name']}. I'll help you track your progress!"
-                else:
-                    reply_text = "I couldn't understand your goal. Please try again with something like: 'I want to save $1000 for a vacation'"
-                return jsonify({'reply': reply_text}), 200
-            except Exception as e:
-                logging.exception("Error in set goal intent")
-                return jsonify({'reply': "I'm having trouble setting up your goal right now. Please try again."}), 200
+    except Exception as e:
+        logger.exception("Error in aggregates_endpoint")
+        return jsonify({'error': 'Could not compute aggregates.'}), 500
+
+class ChatRequest:
+    """
+    Per-request pipeline state.
+    Each stage (model, transactions, categories, aggregates) is computed on
+    first access and memoized, so a handler only pays for what it uses.
+    """
+
+    STAGES = {
+        'model': 'model',
+        'transactions': 'transactions',
+        'categories': 'categorized_transactions',
+        'aggregates': 'aggregates'
+    }
+
+    def __init__(self, message, auth_header, wants_stream=False):
+        self.message = message
+        self.message_lower = message.lower()
+        self.auth_header = auth_header
+        self.wants_stream = wants_stream
+        self.user_id = get_user_id(auth_header)
+        # Unverified callers share the anonymous id, so they get a private store and no shared caches
+        self.unverified = is_unverified_caller(self.user_id, auth_header)
+        self.transaction_store = TransactionStore() if self.unverified else get_transaction_store(self.user_id)
+
+    @cached_property
+    def model(self):
+        with stage_timer('model'):
+            return get_model()
+
+    @cached_property
+    def transactions(self):
+        with stage_timer('get_transactions'):
+            transactions_data = get_transactions(self.auth_header)
+        with stage_timer('ingest'):
+            if isinstance(transactions_data, list):
+                self.transaction_store.ingest(transactions_data)
+        return transactions_data
+
+    @cached_property
+    def categorized_transactions(self):
+        transactions_data = self.transactions
+        if not isinstance(transactions_data, list):
+            return transactions_data
+        model = self.model
+        with stage_timer('categorize'):
+            categorize_pending(transactions_data, self.transaction_store, model, None if self.unverified else self.user_id)
+        return transactions_data
+
+    @cached_property
+    def aggregates(self):
+        self.transactions
+        return self.transaction_store
+
+    def resolve(self, stages):
+        """Evaluate the given stages in order."""
+        for stage in stages:
+            getattr(self, self.STAGES[stage])
+
+def extract_slots(intent, chat, parse_locally, extract_with_model):
+    """Parse a goal or budget command locally, asking the model only if that fails."""
+    with stage_timer(f'extract_{intent}'):
+        slots = parse_locally(chat.message)
+        if slots:
+            metrics.inc("copilot_slot_parse_total", intent=intent, source='local')
+            return slots
+        slots = extract_with_model(chat.message, chat.model)
+        metrics.inc("copilot_slot_parse_total", intent=intent, source='model' if slots else 'failed')
+        return slots
+
+# Registered chat intents as (keywords, required stages, handler), in priority order
+CHAT_INTENTS = []
+_intent_matcher = None
+
+def chat_intent(keywords, requires=()):
+    """Register a chat intent handler triggered by any of the keywords."""
+    def register(handler):
+        global _intent_matcher
+        CHAT_INTENTS.append((keywords, requires, handler))
+        _intent_matcher = None
+        return handler
+    return register
+
+def detect_intent(message_lower):
+    """
+    Return (required stages, handler) for a lowercased message.
+    All keywords are matched in one left-to-right regex pass. At each position
+    the longest keyword wins and consumes its text, so a keyword that overlaps
+    it does not count: "check my budget for rent" is a budget check, not
+    "budget for", and "my goal to save" is goal progress, not "goal to save".
+    Among the keywords that matched, the earliest registered intent wins. The
+    intent registered without keywords is the default.
+    """
+    global _intent_matcher
+    if _intent_matcher is None:
+        keyword_intents = {}
+        for index, (keywords, _, _) in enumerate(CHAT_INTENTS):
+            for keyword in keywords or ():
+                keyword_intents.setdefault(keyword, index)
+        pattern = re.compile('|'.join(re.escape(k) for k in sorted(keyword_intents, key=len, reverse=True)))
+        _intent_matcher = (pattern, keyword_intents)
+    
+    pattern, keyword_intents = _intent_matcher
+    matched = [keyword_intents[m.group(0)] for m in pattern.finditer(message_lower)]
+    if matched:
+        _, requires, handler = CHAT_INTENTS[min(matched)]
+        return requires, handler
+    for keywords, requires, handler in CHAT_INTENTS:
+        if keywords is None:
+            return requires, handler
+    raise LookupError("No default chat intent registered")
+
+@chat_intent(["set a goal", "i want to save", "save for", "goal to save"])
+def handle_set_goal(chat):
+    """Intent 1: Set Goal"""
+    try:
+        goal_data = extract_slots('goal', chat, parse_goal_locally, extract_goal_from_message)
+        if goal_data:
+            user_goal = {
+                'name': goal_data['name'],
+                'target': float(goal_data['target_amount']),
+                'start_date': datetime.now().isoformat()
+            }
+            user_state.set(chat.user_id, 'goal', user_goal)
+            chat.transaction_store.income_since(_epoch_day(datetime.now().date()))
+            reply_text = f"Perfect! I've set a savings goal of ${user_goal['target']:.2f} for your {user_goal['name']}. I'll help you track your progress!"
+        else:
+            reply_text = "I couldn't understand your goal. Please try again with something like: 'I want to save $1000 for a vacation'"
+        return jsonify({'reply': reply_text}), 200
+    except Exception as e:
+        logging.exception("Error in set goal intent")
+        return jsonify({'reply': "I'm having trouble setting up your goal right now. Please try again."}), 200
+
+@chat_intent(["set a budget", "my budget is", "budget for"])
+def handle_set_budget(chat):
+    """Intent 2: Set Budget"""
+    try:
+        budget_data = extract_slots('budget', chat, parse_budget_locally, extract_budget_from_message)
+        if budget_data:
+            category = budget_data['category'].title()
+            amount = float(budget_data['amount'])
+            user_state.update(chat.user_id, 'budgets', lambda budgets: {**budgets, category: amount}, {})
+            tip_scheduler.schedule(chat.user_id)
+            reply_text = f"Great! I've set a monthly budget of ${amount:.2f} for {category}. I'll help you track your spending in this category."
+        else:
+            reply_text = "I couldn't understand your budget. Please try again with something like: 'Set a $500 budget for Groceries'"
+        return jsonify({'reply': reply_text}), 200
+    except Exception as e:
+        logging.exception("Error in set budget intent")
+        return jsonify({'reply': "I'm having trouble setting up your budget right now. Please try again."}), 200
+
+@chat_intent(["check my budget", "budget status", "how is my budget"], requires=('model', 'categories', 'aggregates'))
+def handle_check_budget(chat):
+    """Intent 3: Check Budget"""
+    try:
+        user_budgets = user_state.get(chat.user_id, 'budgets', {})
+        if not user_budgets:
+            return jsonify({'reply': "You haven't set any budgets yet. Try saying 'Set a $500 budget for Groceries' to get started!"}), 200
         
-        # Intent 2: Set Budget
-        elif any(keyword in user_message_lower for keyword in ["set a budget", "my budget is", "budget for"]):
-            try:
-                budget_data = extract_budget_from_message(user_message, model)
-                if budget_data:
-                    category = budget_data['category'].title()
-                    amount = float(budget_data['amount'])
-                    user_budgets[category] = amount
-                    reply_text = f"Great! I've set a monthly budget of ${amount:.2f} for {category}. I'll help you track your spending in this category."
-                else:
-                    reply_text = "I couldn't understand your budget. Please try again with something like: 'Set a $500 budget for Groceries'"
-                return jsonify({'reply': reply_text}), 200
-            except Exception as e:
-                logging.exception("Error in set budget intent")
-                return jsonify({'reply': "I'm having trouble setting up your budget right now. Please try again."}), 200
+        # Find which category the user is asking about, by any accepted spelling or by its saved name
+        mentioned = [CATEGORY_ALIASES[m.group(1).lower()] for m in CATEGORY_PATTERN.finditer(chat.message)]
+        asked_category = next((category for category in mentioned if category in user_budgets), None)
+        if not asked_category:
+            asked_category = next((category for category in user_budgets if category.lower() in chat.message_lower), None)
         
-        # Intent 3: Check Budget
-        elif any(keyword in user_message_lower for keyword in ["check my budget", "budget status", "how is my budget"]):
-            try:
-                if not user_budgets:
-                    return jsonify({'reply': "You haven't set any budgets yet. Try saying 'Set a $500 budget for Groceries' to get started!"}), 200
-                
-                # Find which category the user is asking about
-                asked_category = None
-                for category in user_budgets.keys():
-                    if category.lower() in user_message_lower:
-                        asked_category = category
-                        break
-                
-                if not asked_category:
-                    categories_list = ", ".join(user_budgets.keys())
-                    return jsonify({'reply': f"Which budget would you like to check? You have budgets for: {categories_list}"}), 200
-                
-                # Calculate spending for this category in current month
-                budget_amount = user_budgets[asked_category]
-                total_spent = 0.0
-                current_month = datetime.now().month
-                current_year = datetime.now().year
-                
-                if isinstance(transactions_data, list):
-                    for transaction in transactions_data:
-                        try:
-                            date_str = transaction.get('date', '')
-                            if date_str:
-                                transaction_date = datetime.fromisoformat(date_str.split('T')[0])
-                                amount = transaction.get('amount', 0)
-                                category = transaction.get('category', '')
-                                
-                                # Only count negative amounts (expenses) in the current month for this category
-                                if (transaction_date.month == current_month and
-                                    transaction_date.year == current_year and
-                                    amount < 0 and
-                                    category == asked_category):
-                                    total_spent += abs(amount) / 100.0  # Convert cents to dollars
-                        except (ValueError, TypeError):
-                            continue
-                
-                remaining_budget = budget_amount - total_spent
-                
-                if total_spent == 0:
-                    reply_text = f"Good news! You haven't spent anything from your {asked_category} budget of ${budget_amount:.2f} this month."
-                elif remaining_budget >= 0:
-                    percentage_used = (total_spent / budget_amount) * 100
-                    reply_text = f"For your {asked_category} budget of ${budget_amount:.2f}, you've spent ${total_spent:.2f} ({percentage_used:.1f}%). You have ${remaining_budget:.2f} remaining this month."
-                else:
-                    overspent = abs(remaining_budget)
-                    reply_text = f"Alert! You've exceeded your {asked_category} budget of ${budget_amount:.2f}. You've spent ${total_spent:.2f}, which is ${overspent:.2f} over budget this month."
-                
-                return jsonify({'reply': reply_text}), 200
-            except Exception as e:
-                logging.exception("Error in check budget intent")
-                return jsonify({'reply': "I'm having trouble checking your budget right now. Please try again."}), 200
+        if not asked_category:
+            categories_list = ", ".join(user_budgets.keys())
+            return jsonify({'reply': f"Which budget would you like to check? You have budgets for: {categories_list}"}), 200
         
-        # Intent 4: Check Goal Progress
-        elif any(keyword in user_message_lower for keyword in ["goal progress", "how am i doing", "my goal", "check goal"]):
-            try:
-                if not user_goal:
-                    return jsonify({'reply': "You haven't set a savings goal yet. Try saying 'I want to save $1000 for a vacation' to get started!"}), 200
-                
-                # Calculate total savings since goal was set
-                total_saved = 0.0
-                goal_start_date = None
-                
-                if 'start_date' in user_goal:
-                    try:
-                        goal_start_date = datetime.fromisoformat(user_goal['start_date'].split('T')[0])
-                    except (ValueError, TypeError):
-                        goal_start_date = None
-                
-                if isinstance(transactions_data, list):
-                    for transaction in transactions_data:
-                        try:
-                            amount = transaction.get('amount', 0)
-                            # Only count positive amounts (deposits/income) as savings
-                            if amount > 0:
-                                if goal_start_date:
-                                    date_str = transaction.get('date', '')
-                                    if date_str:
-                                        transaction_date = datetime.fromisoformat(date_str.split('T')[0])
-                                        if transaction_date >= goal_start_date:
-                                            total_saved += amount / 100.0  # Convert cents to dollars
-                                else:
-                                    total_saved += amount / 100.0
-                        except (ValueError, TypeError):
-                            continue
-                
-                goal_name = user_goal.get('name', 'your goal')
-                target_amount = user_goal.get('target', 0)
-                
-                # Generate progress response
-                if total_saved >= target_amount:
-                    excess = total_saved - target_amount
-                    reply_text = f"🎉 Congratulations! You've exceeded your savings goal! You've saved ${total_saved:.2f} for your {goal_name}, which is ${excess:.2f} more than your ${target_amount:.2f} target. Amazing work!"
-                else:
-                    percentage_complete = (total_saved / target_amount) * 100 if target_amount > 0 else 0
-                    remaining = target_amount - total_saved
-                    reply_text = f"Great progress! You've saved ${total_saved:.2f} of your ${target_amount:.2f} goal for your {goal_name} ({percentage_complete:.1f}% complete). You need ${remaining:.2f} more to reach your goal!"
-                
-                return jsonify({'reply': reply_text}), 200
-            except Exception as e:
-                logging.exception("Error in check goal progress intent")
-                return jsonify({'reply': "I'm having trouble checking your goal progress right now. Please try again."}), 200
+        # Calculate spending for this category in current month
+        budget_amount = user_budgets[asked_category]
+        now = datetime.now()
+        total_spent = chat.aggregates.category_spent(now.year, now.month, asked_category) / 100.0  # Convert cents to dollars
         
-        # Intent 5: General Q&A (default case)
+        remaining_budget = budget_amount - total_spent
+        
+        if total_spent == 0:
+            reply_text = f"Good news! You haven't spent anything from your {asked_category} budget of ${budget_amount:.2f} this month."
+        elif remaining_budget >= 0:
+            percentage_used = (total_spent / budget_amount) * 100
+            reply_text = f"For your {asked_category} budget of ${budget_amount:.2f}, you've spent ${total_spent:.2f} ({percentage_used:.1f}%). You have ${remaining_budget:.2f} remaining this month."
         else:
-            try:
-                system_instruction = """
-                You are a helpful and friendly financial co-pilot for a bank customer.
-                Provide clear, concise answers based on the transaction data provided.
-                - Give direct answers in the first sentence
-                - Keep responses conversational and helpful
-                - Don't use markdown formatting
-                - If asked about spending patterns, use the categorized transaction data
-                """
-                
-                # Format transaction data for Gemini (limit for performance)
-                if isinstance(transactions_data, list) and transactions_data:
-                    recent_transactions = transactions_data[:30]  # Latest 30 transactions
-                    transaction_summary = f"Recent Transaction Data:\n{json.dumps(recent_transactions, indent=2)}"
-                else:
-                    transaction_summary = "No transaction data available."
-                
-                combined_prompt = f"{system_instruction}\n\n{transaction_summary}\n\nUser Question: {user_message}"
-                
-                response = model.generate_content(combined_prompt)
-                reply_text = response.text.strip()
-                
-                return jsonify({'reply': reply_text}), 200
-            except Exception as e:
-                logging.exception("Error in general Q&A intent")
-                return jsonify({'reply': "I'm having trouble processing your question right now. Please try again or rephrase your question."}), 200
+            overspent = abs(remaining_budget)
+            reply_text = f"Alert! You've exceeded your {asked_category} budget of ${budget_amount:.2f}. You've spent ${total_spent:.2f}, which is ${overspent:.2f} over budget this month."
+        
+        return jsonify({'reply': reply_text}), 200
+    except Exception as e:
+        logging.exception("Error in check budget intent")
+        return jsonify({'reply': "I'm having trouble checking your budget right now. Please try again."}), 200
+
+@chat_intent(["goal progress", "how am i doing", "my goal", "check goal"], requires=('aggregates',))
+def handle_goal_progress(chat):
+    """Intent 4: Check Goal Progress"""
+    try:
+        user_goal = user_state.get(chat.user_id, 'goal', {})
+        if not user_goal:
+            return jsonify({'reply': "You haven't set a savings goal yet. Try saying 'I want to save $1000 for a vacation' to get started!"}), 200
+        
+        # Calculate total savings since goal was set
+        goal_start_date = _parse_date(user_goal.get('start_date'))
+        start_day = _epoch_day(goal_start_date) if goal_start_date else None
+        total_saved = chat.aggregates.income_since(start_day) / 100.0  # Convert cents to dollars
+        
+        goal_name = user_goal.get('name', 'your goal')
+        target_amount = user_goal.get('target', 0)
+        
+        # Generate progress response
+        if total_saved >= target_amount:
+            excess = total_saved - target_amount
+            reply_text = f"🎉 Congratulations! You've exceeded your savings goal! You've saved ${total_saved:.2f} for your {goal_name}, which is ${excess:.2f} more than your ${target_amount:.2f} target. Amazing work!"
+        else:
+            percentage_complete = (total_saved / target_amount) * 100 if target_amount > 0 else 0
+            remaining = target_amount - total_saved
+            reply_text = f"Great progress! You've saved ${total_saved:.2f} of your ${target_amount:.2f} goal for your {goal_name} ({percentage_complete:.1f}% complete). You need ${remaining:.2f} more to reach your goal!"
+        
+        return jsonify({'reply': reply_text}), 200
+    except Exception as e:
+        logging.exception("Error in check goal progress intent")
+        return jsonify({'reply': "I'm having trouble checking your goal progress right now. Please try again."}), 200
+
+@chat_intent(None, requires=('model', 'categories', 'aggregates'))
+def handle_general_question(chat):
+    """Intent 5: General Q&A (default case)"""
+    try:
+        system_instruction = """
+        You are a helpful and friendly financial co-pilot for a bank customer.
+        Provide clear, concise answers based on the transaction data provided.
+        - Give direct answers in the first sentence
+        - Keep responses conversational and helpful
+        - Don't use markdown formatting
+        - If asked about spending patterns, use the categorized transaction data
+        """
+        
+        # Repeated questions against unchanged data are answered from the cache
+        cache_key = None if chat.unverified else answer_cache.key(chat.user_id, chat.message, chat.aggregates.snapshot_id())
+        cached_reply = answer_cache.get(cache_key) if cache_key else None
+        if cached_reply is not None:
+            if chat.wants_stream:
+                return Response(_sse_event({'text': cached_reply}) + _sse_event({}, event='done'),
+                                mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+            return jsonify({'reply': cached_reply}), 200
+        
+        # Summarize the whole categorized history within the prompt token budget
+        store = chat.aggregates
+        with stage_timer('qa_context'):
+            transaction_summary, context_stats = build_qa_context(store, chat.message, QA_PROMPT_TOKEN_BUDGET)
+        metrics.observe("copilot_qa_context_chars", context_stats["chars"])
+        metrics.observe("copilot_qa_context_tokens", context_stats["estimated_tokens"])
+        metrics.observe("copilot_qa_context_rows", context_stats["rows"])
+        
+        combined_prompt = f"{system_instruction}\n\n{transaction_summary}\n\nUser Question: {chat.message}"
+        
+        if chat.wants_stream:
+            def generate():
+                try:
+                    parts = []
+                    for text in chat.model.stream_content(combined_prompt, purpose='qa'):
+                        parts.append(text)
+                        yield _sse_event({'text': text})
+                    if cache_key:
+                        answer_cache.set(cache_key, "".join(parts).strip())
+                    yield _sse_event({}, event='done')
+                except Exception as e:
+                    logger.exception("Error streaming general Q&A answer")
+                    yield _sse_event({'reply': "I'm having trouble processing your question right now. Please try again or rephrase your question."}, event='error')
+            
+            return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        
+        # Concurrent identical questions share one model call
+        generate_reply = lambda: chat.model.generate_content(combined_prompt, purpose='qa').text.strip()
+        with stage_timer('generate'):
+            reply_text = answer_flight.do(cache_key, generate_reply) if cache_key else generate_reply()
+        if cache_key:
+            answer_cache.set(cache_key, reply_text)
+        
+        return jsonify({'reply': reply_text}), 200
+    except Exception as e:
+        logging.exception("Error in general Q&A intent")
+        return jsonify({'reply': "I'm having trouble processing your question right now. Please try again or rephrase your question."}), 200
+
+@app.route('/api/chat', methods=['POST'])
+def chat_endpoint():
+    """
+    Main chat endpoint with robust error handling and complete logic.
+    The intent is detected first; only the stages its handler requires run.
+    CRITICAL: Every logical path MUST end with a return statement.
+    """
+    try:
+        # Step 1: Get user message
+        data = request.get_json()
+        if not data or 'message' not in data:
+            return jsonify({'error': "Invalid request: missing 'message' field"}), 400
+        
+        wants_stream = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+        chat = ChatRequest(data['message'], request.headers.get('Authorization'), wants_stream)
+        
+        # Step 2: Detect the intent
+        requires, handler = detect_intent(chat.message_lower)
+        metrics.inc("copilot_chat_intent_total", intent=handler.__name__)
+        
+        # Step 3: Make sure the AI service is available if the intent needs it
+        if 'model' in requires and not chat.model:
+            return jsonify({"error": "AI service is currently unavailable. Please try again later."}), 500
+        
+        # Step 4: Run the stages this intent depends on, then the handler
+        chat.resolve(requires)
+        with stage_timer('handler'):
+            return handler(chat)
     
     except Exception as e:
         logging.exception("Unexpected error in chat_endpoint")
         return jsonify({'error': 'An unexpected error occurred. Please try again.'}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=False)
\ No newline at end of file
+    # Development server only; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '8080')), debug=False)
\ No newline at end of file
@@ -0,0 +1,288 @@
+"""
+Benchmark and load test for the chat and proactive tip endpoints.
+
+Every chat intent and /api/proactive_tip is driven against synthetic
+transaction histories with a stub model of configurable latency, either
+in-process through the Flask test client or over real HTTP. By default the
+history is served by fake_bank.py and synced into the ledger like in
+production; --source copies hands every request fresh, uncategorized
+copies instead, like the built-in demo data.
+
+Examples:
+    python benchmark.py --rows 10,10000,1000000 --requests 200 --concurrency 8
+    python benchmark.py --mode http --model-latency-ms 300 --model-jitter-ms 100
+    python benchmark.py --source copies --rows 10,1000
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --compare bench_baseline.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = {
+    "set_goal": ("/api/chat", "I want to save $1000 for a vacation"),
+    "set_budget": ("/api/chat", "Set a $500 budget for Groceries"),
+    "check_budget": ("/api/chat", "check my budget for groceries"),
+    "goal_progress": ("/api/chat", "goal progress"),
+    "qa": ("/api/chat", "What did I spend the most on?"),
+    "proactive_tip": ("/api/proactive_tip", None)
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("client", "http"), default="client",
+                        help="Flask test client in-process, or real HTTP against a local server")
+    parser.add_argument("--rows", default="10,1000,100000",
+                        help="comma-separated synthetic history sizes (10 to 1000000)")
+    parser.add_argument("--source", choices=("bank", "copies"), default="bank",
+                        help="sync from an in-process fake_bank, or give every request fresh copies of the history")
+    parser.add_argument("--bank-sync-interval", type=float, default=60.0,
+                        help="seconds before the ledger is synced with the bank again")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and size")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--model-latency-ms", type=float, default=200.0, help="stub model mean latency")
+    parser.add_argument("--model-jitter-ms", type=float, default=50.0, help="stub model latency jitter (+/-)")
+    parser.add_argument("--disable-answer-cache", action="store_true",
+                        help="make every Q&A request reach the model")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="report each scenario's peak Python heap via tracemalloc (slow) "
+                             "instead of the process-wide peak RSS")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as a baseline JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="compare p95 latency and throughput against a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression when comparing")
+    return parser.parse_args()
+
+
+def configure_environment(args, workdir):
+    """Point every store at a scratch directory and select the stub model before the app is imported."""
+    os.environ.update({
+        "MODEL_BACKEND": "stub",
+        "MODEL_STUB_LATENCY_MS": str(args.model_latency_ms),
+        "MODEL_STUB_JITTER_MS": str(args.model_jitter_ms),
+        "STATE_BACKEND": "memory",
+        "JWT_ALLOW_UNVERIFIED": "1",
+        "CATEGORY_CACHE_PATH": os.path.join(workdir, "category_cache.db"),
+        "LEDGER_DB_PATH": os.path.join(workdir, "transactions.db"),
+        "STATE_DB_PATH": os.path.join(workdir, "user_state.db"),
+        "BANK_SYNC_INTERVAL_SECONDS": str(args.bank_sync_interval),
+        "BANK_PAGE_SIZE": "5000"
+    })
+    os.environ.pop("BANK_API_URL", None)
+    if args.disable_answer_cache:
+        os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+
+
+def peak_rss_mb():
+    """
+    High-water mark of the whole process's resident set size (ru_maxrss is in
+    kilobytes on Linux). It never goes down, so it is not a per-scenario figure.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ClientDriver:
+    """Sends requests in-process through the Flask test client."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+
+    def send(self, path, message, token):
+        client = self.flask_app.test_client()
+        headers = {"Authorization": f"Bearer {token}"}
+        if message is None:
+            response = client.post(path, headers=headers)
+        else:
+            response = client.post(path, json={"message": message}, headers=headers)
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class FakeBankServer:
+    """Serves fake_bank.py from a background thread; the app syncs from it through BANK_API_URL."""
+
+    def __init__(self):
+        from werkzeug.serving import make_server
+        import fake_bank
+        self.fake_bank = fake_bank
+        self.server = make_server("127.0.0.1", 0, fake_bank.app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/transactions/{{account}}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def load(self, transactions):
+        with self.fake_bank._lock:
+            self.fake_bank._transactions[:] = transactions
+
+    def close(self):
+        self.server.shutdown()
+
+
+class HttpDriver:
+    """Sends requests over HTTP to the app served from a background thread."""
+
+    def __init__(self, flask_app):
+        import requests
+        from werkzeug.serving import make_server
+        self.server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=64)
+        self.session.mount("http://", adapter)
+
+    def send(self, path, message, token):
+        headers = {"Authorization": f"Bearer {token}"}
+        if message is None:
+            response = self.session.post(self.base_url + path, headers=headers, timeout=120)
+        else:
+            response = self.session.post(self.base_url + path, json={"message": message}, headers=headers, timeout=120)
+        return response.status_code
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_scenario(driver, path, message, token, total, concurrency):
+    """Fire total requests from concurrency workers; returns latency and throughput statistics."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one_request(_):
+        nonlocal errors
+        start = time.perf_counter()
+        status = driver.send(path, message, token)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one_request, range(total)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": total / duration if duration else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Return human-readable regressions of p95 latency or throughput beyond tolerance."""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {previous['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+        if result["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {previous['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="copilot-bench-")
+    configure_environment(args, workdir)
+
+    bank = None
+    if args.source == "bank":
+        bank = FakeBankServer()
+        os.environ["BANK_API_URL"] = bank.url
+
+    import jwt
+    import app
+    from fake_bank import generate_transactions
+
+    dataset = {"transactions": []}
+    if args.source == "copies":
+        # Fresh dicts per request, as the demo data path returns them
+        app.get_transactions = lambda auth_header: [dict(t) for t in dataset["transactions"]]
+
+    driver = HttpDriver(app.app) if args.mode == "http" else ClientDriver(app.app)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    results = {}
+    memory_label = "heap MB" if args.tracemalloc else "proc peak MB"
+
+    print(f"{'rows':>8} {'scenario':<14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>6} {memory_label:>12}")
+    try:
+        for rows in [int(value) for value in args.rows.split(",")]:
+            dataset["transactions"] = generate_transactions(rows)
+            if bank:
+                bank.load(dataset["transactions"])
+            token = jwt.encode({"sub": f"bench-{rows}"}, "benchmark-signing-key-not-verified-here", algorithm="HS256")
+
+            # First request syncs, ingests and categorizes the whole history
+            start = time.perf_counter()
+            driver.send("/api/chat", SCENARIOS["check_budget"][1], token)
+            warmup_ms = (time.perf_counter() - start) * 1000
+            print(f"{rows:>8} {'(warm-up)':<14} {warmup_ms:>9.1f}")
+
+            for name in scenarios:
+                path, message = SCENARIOS[name]
+                if args.tracemalloc:
+                    tracemalloc.start()
+                result = run_scenario(driver, path, message, token, args.requests, args.concurrency)
+                if args.tracemalloc:
+                    memory = result["peak_heap_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                    tracemalloc.stop()
+                else:
+                    memory = result["process_peak_rss_mb"] = peak_rss_mb()
+                results[f"{args.mode}/{args.source}/{rows}/{name}"] = result
+                print(f"{rows:>8} {name:<14} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                      f"{result['throughput_rps']:>9.1f} {result['errors']:>6} {memory:>12.1f}")
+    finally:
+        driver.close()
+        if bank:
+            bank.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Peak process RSS: {peak_rss_mb():.1f} MB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Local stand-in for the bank transactions API, for development and load tests.
+
+Run with:  FAKE_BANK_TRANSACTIONS=10000 python fake_bank.py
+Then point the co-pilot at it:  BANK_API_URL=http://localhost:8081/transactions/{account}
+"""
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from flask import Flask, request, jsonify
+
+MERCHANTS = [
+    ("Starbucks Coffee", -300, -900), ("Whole Foods Market", -2000, -15000), ("Netflix Subscription", -1599, -1599),
+    ("Uber Trip", -800, -4500), ("Shell Gas Station", -3000, -7000), ("Amazon Marketplace", -1000, -20000),
+    ("Rent Payment", -150000, -150000), ("Comcast Internet", -7999, -7999), ("CVS Pharmacy", -500, -4000),
+    ("Transfer to Savings", -10000, -50000), ("Local Bistro", -2500, -9000), ("Mystery Vendor", -100, -5000)
+]
+
+app = Flask(__name__)
+_lock = threading.Lock()
+_transactions = []
+
+
+def generate_transactions(count, start_id=1, seed=0):
+    """Synthetic history, newest first: monthly salary plus random merchant charges."""
+    rng = random.Random(seed + start_id)
+    now = datetime.utcnow()
+    transactions = []
+    for offset in range(count):
+        transaction_id = start_id + offset
+        date = now - timedelta(minutes=(count - offset) * 30)
+        if transaction_id % 60 == 0:
+            description, amount = "Salary Deposit - Acme Corp", 250000
+        else:
+            description, low, high = rng.choice(MERCHANTS)
+            amount = rng.randint(high, low)
+        transactions.append({
+            "transactionId": transaction_id,
+            "description": description,
+            "amount": amount,
+            "date": date.strftime("%Y-%m-%dT%H:%M:%SZ")
+        })
+    transactions.reverse()
+    return transactions
+
+
+def _etag():
+    return f'"{len(_transactions)}-{_transactions[0]["transactionId"] if _transactions else 0}"'
+
+
+@app.route('/transactions/<account>', methods=['GET'])
+def list_transactions(account):
+    """Newest-first transactions, optionally only those after since_id, paged by cursor."""
+    with _lock:
+        etag = _etag()
+        if request.headers.get('If-None-Match') == etag:
+            return '', 304
+        since_id = request.args.get('since_id', type=int)
+        limit = request.args.get('limit', default=500, type=int)
+        cursor = request.args.get('cursor', default=0, type=int)
+        # Newest first, so the rows after since_id are a prefix of the list
+        available = len(_transactions)
+        if since_id is not None:
+            available = next((i for i, t in enumerate(_transactions) if t["transactionId"] <= since_id), available)
+        page = _transactions[cursor:min(cursor + limit, available)]
+    next_cursor = str(cursor + limit) if cursor + limit < available else None
+    response = jsonify({"transactions": page, "next_cursor": next_cursor})
+    response.headers['ETag'] = etag
+    return response
+
+
+@app.route('/admin/add', methods=['POST'])
+def add_transactions():
+    """Append new transactions, to exercise incremental sync."""
+    count = request.args.get('count', default=1, type=int)
+    with _lock:
+        next_id = (_transactions[0]["transactionId"] + 1) if _transactions else 1
+        _transactions[:0] = generate_transactions(count, start_id=next_id)
+    return jsonify({"total": len(_transactions)})
+
+
+_transactions.extend(generate_transactions(int(os.getenv("FAKE_BANK_TRANSACTIONS", "1000"))))
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '8081')), debug=False, threaded=True)